@@ -0,0 +1,309 @@
+""" Offline benchmark of the removal tool against a local Salesforce stand-in """
+
+import argparse
+import contextlib
+import csv
+import importlib.util
+import json
+import math
+import os
+import random
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import types
+
+SCRIPT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'process-sfdc-data-removal-requests.py')
+
+def load_tool():
+    """ Load the tool module from its script, whose name is not importable """
+    spec = importlib.util.spec_from_file_location('removal_tool', SCRIPT_PATH)
+    tool = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(tool)
+    return tool
+
+tool = load_tool()
+
+HOUSEHOLD_RECORD_TYPE_ID = tool.HOUSEHOLD_RECORD_TYPE_ID
+
+def contact_index(email):
+    """ Get the index of a synthetic contact from its email address, or None if it has no contact """
+    match = re.fullmatch(r'user(\d+)@bench\.example', email)
+    return int(match.group(1)) if match else None
+
+def contact_record(i):
+    return {
+        'attributes': {'type': 'Contact'},
+        'Id': '003B%011d' % i,
+        'Email': 'user%d@bench.example' % i,
+        'GDPR__c': False,
+        'HasOptedOutOfEmail': False,
+        'Marketing_Status__c': None,
+        # Two contacts per account, two out of three accounts are households
+        'AccountId': '001B%011d' % (i // 2),
+        'Account': {
+            'attributes': {'type': 'Account'},
+            'RecordTypeId': HOUSEHOLD_RECORD_TYPE_ID if (i // 2) % 3 else '012B00000000000AAA',
+            'GDPR_Account__c': False
+        }
+    }
+
+class FakeSalesforce:
+    """ Stand-in for simple_salesforce.Salesforce that answers the REST query and Bulk API 1.0 calls locally """
+
+    def __init__(self, latency=0.0, page_size=2000, failure_rate=0.0, match_rate=0.8, flagged=0, seed=0):
+        self.latency = latency
+        self.page_size = page_size
+        self.failure_rate = failure_rate
+        self.match_rate = match_rate
+        self.flagged = flagged
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.api_calls = 0
+        self.cursors = {}
+        # run_report.attach() counts the calls through the session's response hooks
+        self.session = types.SimpleNamespace(hooks={'response': []})
+        self.bulk = FakeBulk(self)
+
+    def call(self, count=1):
+        """ Simulate API round trips """
+        with self.lock:
+            self.api_calls += count
+        for hook in list(self.session.hooks['response']):
+            for _ in range(count):
+                hook(None)
+        if self.latency:
+            time.sleep(self.latency * count)
+
+    def has_contact(self, i):
+        # Spread the matches evenly over the input
+        return (i * 7919) % 1000 < self.match_rate * 1000
+
+    def query_records(self, query):
+        match = re.search(r'Email IN \((.*)\)', query, re.S)
+        if match:
+            emails = [value.strip().strip("'").replace("\\'", "'") for value in match.group(1).split(',')]
+            indexes = (contact_index(email) for email in emails)
+            return [contact_record(i) for i in indexes if i is not None and self.has_contact(i)]
+
+        # Queries for flagged records return one synthetic Id per flagged record
+        object_name = re.search(r'FROM (\w+)', query).group(1)
+        if object_name == 'Account':
+            count = self.flagged // 4
+        else:
+            count = self.flagged
+        return [{'attributes': {'type': object_name}, 'Id': '%sB%011d' % (object_name[:3], i)} for i in range(count)]
+
+    def query_all_iter(self, query):
+        records = self.query_records(query)
+        for start in range(0, max(len(records), 1), self.page_size):
+            self.call()
+            yield from records[start:start + self.page_size]
+
+    def query(self, query):
+        return self.query_page(self.query_records(query), 0)
+
+    def query_more(self, next_records_url, identifier_is_url=False):
+        # The URL carries the query results and the offset of the next page
+        records, start = self.cursors.pop(next_records_url)
+        return self.query_page(records, start)
+
+    def query_page(self, records, start):
+        self.call()
+        page = {'totalSize': len(records), 'done': start + self.page_size >= len(records), 'records': records[start:start + self.page_size]}
+        if not page['done']:
+            page['nextRecordsUrl'] = f'/services/data/v59.0/query/01gB{id(records)}-{start + self.page_size}'
+            self.cursors[page['nextRecordsUrl']] = (records, start + self.page_size)
+        return page
+
+    def query_all(self, query):
+        records = list(self.query_all_iter(query))
+        return {'totalSize': len(records), 'done': True, 'records': records}
+
+    def limits(self):
+        return {'DailyApiRequests': {'Max': 1000000, 'Remaining': 1000000 - self.api_calls}}
+
+    def bulk_results(self, records, batch_size):
+        # Creating, closing and polling the job, then submitting and fetching the results of each batch
+        self.call(3 + 2 * math.ceil(len(records) / batch_size))
+        results = []
+        for record in records:
+            with self.lock:
+                failed = self.random.random() < self.failure_rate
+            if failed:
+                results.append({'success': False, 'created': False, 'id': None, 'errors': [{'statusCode': 'UNABLE_TO_LOCK_ROW', 'message': 'unable to obtain exclusive access to this record', 'fields': []}]})
+            else:
+                results.append({'success': True, 'created': False, 'id': record['Id'], 'errors': []})
+        return results
+
+class FakeBulk:
+    def __init__(self, sf):
+        self.sf = sf
+
+    def __getattr__(self, object_name):
+        return FakeBulkType(self.sf)
+
+class FakeBulkType:
+    def __init__(self, sf):
+        self.sf = sf
+
+    def update(self, records, batch_size=10000, use_serial=False):
+        return self.sf.bulk_results(list(records), batch_size)
+
+    def delete(self, records, batch_size=10000, use_serial=False):
+        return self.sf.bulk_results(list(records), batch_size)
+
+    def hard_delete(self, records, batch_size=10000, use_serial=False):
+        return self.sf.bulk_results(list(records), batch_size)
+
+def write_onetrust_export(path, rows):
+    """ Write a synthetic OneTrust CSV export """
+    workflows = list(tool.WORKFLOW_REQUEST_TYPES) + ['[Consumer] Access Request']
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Request ID'] + tool.REQUEST_COLUMNS)
+        for i in range(rows):
+            # Some tasks belong to other systems and some emails appear twice
+            assignee = 'Salesforce' if i % 10 else 'Marketing Cloud'
+            email = 'user%d@bench.example' % (i - 1 if i % 50 == 0 and i else i)
+            writer.writerow([f'REQ-{i}', assignee, workflows[i % len(workflows)], email])
+
+def write_email_list(path, rows):
+    """ Write a synthetic TXT list of email addresses """
+    with open(path, 'w', encoding='utf-8') as f:
+        for i in range(rows):
+            f.write('User%d@Bench.example\n' % i)
+
+def run_scenario(action, rows, tool_args, args):
+    """ Run one action end to end in a scratch directory and measure it """
+    sf = FakeSalesforce(args.latency, args.page_size, args.failure_rate, args.match_rate, flagged=rows, seed=args.seed)
+
+    def connect_to_sfdc(options):
+        tool.run_report.attach(sf, options.org['name'])
+        return sf
+
+    tool.connect_to_sfdc = connect_to_sfdc
+
+    with tempfile.TemporaryDirectory(prefix='sfdc-benchmark-') as work_dir:
+        if action == 'requests':
+            file_path = os.path.join(work_dir, 'onetrust_export.csv')
+            write_onetrust_export(file_path, rows)
+            command = ['requests', file_path, '--format', 'csv']
+        elif action == 'emails':
+            file_path = os.path.join(work_dir, 'email_list.txt')
+            write_email_list(file_path, rows)
+            command = ['emails', file_path]
+        else:
+            command = ['delete-flagged']
+
+        options = tool.build_parser().parse_args(tool_args + command)
+        options.interactive = False
+        options.routing_column = None
+        org = tool.make_org_profile('default', {})
+        if options.cache:
+            org['contact_cache'] = tool.ContactCache(os.path.join(work_dir, 'contacts.sqlite'), options.cache_ttl, options.cache_max_entries)
+        orgs = {'default': org}
+        options.request_ledger = tool.RequestLedger(os.path.join(work_dir, 'requests.sqlite')) if options.ledger else None
+
+        current_dir = os.getcwd()
+        os.chdir(work_dir)
+        tool.run_report.reset(action)
+        tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            output = sys.stdout if args.verbose else open(os.devnull, 'w', encoding='utf-8')
+            with contextlib.redirect_stdout(output):
+                handler = {'requests': tool.handle_requests, 'emails': tool.handle_email_list, 'delete-flagged': tool.delete_flagged_records}[action]
+                if action == 'delete-flagged':
+                    handler(orgs, options)
+                else:
+                    handler(orgs, options, file_path=file_path)
+        finally:
+            seconds = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            os.chdir(current_dir)
+            if org['contact_cache'] is not None:
+                org['contact_cache'].connection.close()
+            if options.request_ledger is not None:
+                options.request_ledger.connection.close()
+
+    summary = tool.run_report.summary()
+    return {
+        'action': action,
+        'rows': rows,
+        'seconds': round(seconds, 3),
+        'rows_per_second': round(rows / seconds, 1) if seconds else None,
+        'peak_memory_mb': round(peak / 1024 / 1024, 1),
+        'api_calls': sf.api_calls,
+        'counters': summary['counters'],
+        'stages': summary['stages']
+    }
+
+def measure_startup(runs, executable=None):
+    """ Time fresh processes that start the tool and exit after printing its help """
+    command = [executable] if executable else [sys.executable, SCRIPT_PATH]
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command + ['--help'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        timings.append(time.perf_counter() - start)
+    return {
+        'action': 'startup',
+        'command': ' '.join(command),
+        'runs': runs,
+        'median_seconds': round(statistics.median(timings), 3),
+        'min_seconds': round(min(timings), 3),
+        'max_seconds': round(max(timings), 3)
+    }
+
+def print_results(results):
+    for result in results:
+        if result['action'] == 'startup':
+            print(f"Startup: {result['median_seconds']:.3f}s median, {result['min_seconds']:.3f}s min over {result['runs']} run(s) of {result['command']}.")
+    print(f"{'Action':<16}{'Rows':>10}{'Seconds':>10}{'Rows/s':>12}{'Peak MB':>10}{'API calls':>11}")
+    for result in results:
+        if result['action'] == 'startup':
+            continue
+        print(f"{result['action']:<16}{result['rows']:>10}{result['seconds']:>10.2f}{result['rows_per_second'] or 0:>12.0f}{result['peak_memory_mb']:>10.1f}{result['api_calls']:>11}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark the removal tool against a local Salesforce stand-in. Options not listed here are passed on to the tool, e.g. --pipeline or --batch-size 5000.'
+    )
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 100000], help='Input sizes to run (default: 1000 100000).')
+    parser.add_argument('--actions', nargs='+', choices=['requests', 'emails', 'delete-flagged'], default=['requests', 'emails', 'delete-flagged'], help='Actions to run (default: all).')
+    parser.add_argument('--latency', type=float, default=0.05, help='Seconds per simulated API call (default: 0.05).')
+    parser.add_argument('--page-size', type=int, default=2000, help='Records per query page (default: 2000).')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='Share of bulk records that fail with UNABLE_TO_LOCK_ROW (default: 0).')
+    parser.add_argument('--match-rate', type=float, default=0.8, help='Share of email addresses that have a contact (default: 0.8).')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the simulated failures (default: 0).')
+    parser.add_argument('--startup-runs', type=int, default=5, help='Times to start the tool in a fresh process to measure its startup time (default: 5, 0 to skip).')
+    parser.add_argument('--executable', help='Measure the startup time of this packaged executable instead of the script.')
+    parser.add_argument('--output', help='Also write the results to this JSON file.')
+    parser.add_argument('--verbose', action='store_true', help="Show the tool's own output.")
+    args, tool_args = parser.parse_known_args(argv)
+
+    results = []
+    if args.startup_runs > 0:
+        print(f'Measuring the startup time over {args.startup_runs} run(s)...')
+        results.append(measure_startup(args.startup_runs, args.executable))
+    for rows in args.sizes:
+        for action in args.actions:
+            print(f'Running {action} with {rows} rows...')
+            results.append(run_scenario(action, rows, tool_args, args))
+
+    print_results(results)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f'Results written to {args.output}.')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
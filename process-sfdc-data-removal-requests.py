@@ -3,20 +3,39 @@
 # Look out for the file dialog.
 
 # Import packages
-from InquirerPy import prompt
-from simple_salesforce import Salesforce
-import numpy as np
-import pandas as pd
+# pandas, numpy, simple_salesforce, requests, InquirerPy and tkinter are imported by the functions that use them,
+# so the tool starts quickly and each action only loads what it needs
+import time
+# Start of the startup time, recorded in the run reports
+IMPORT_STARTED = time.perf_counter()
 import datetime
-from math import isnan
+from math import ceil, isnan
 import os
-import tkinter as tk
-from tkinter import filedialog
+import re
 from configparser import ConfigParser
+import argparse
+import collections
+import contextlib
+import contextvars
+import csv
+import io
+import itertools
+import json
+import multiprocessing
+import secrets
+import shutil
+import signal
+import sqlite3
+from urllib.parse import quote_plus
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import sys
+import threading
 import traceback
 
 def get_user_action():
+    # Imported here so headless runs don't pay for it
+    from InquirerPy import prompt
+
     print()
     questions = [
         {
@@ -34,375 +53,2037 @@ def get_user_action():
     answers = prompt(questions)
     return answers['action']
 
-def main():
+def get_script_dir():
+    """ Get the directory of the current script or executable """
+    if getattr(sys, 'frozen', False):
+        # If the application is run as a bundle, the pyInstaller bootloader
+        # sets the sys.frozen attribute and this method returns the path
+        # to the bundle file.
+        return os.path.dirname(sys.executable)
+    else:
+        # If the application is run in a normal Python environment, return
+        # the path to the script file.
+        return os.path.dirname(os.path.abspath(__file__))
+
+def load_config(config_file_path='sfdc.ini'):
+    # Initialize the ConfigParser
+    config = ConfigParser()
+
+    # Check if the config file exists
+    if not os.path.exists(config_file_path):
+        raise FileNotFoundError(f"{config_file_path} does not exist.")
+
+    # Read the config.ini file
+    config.read(config_file_path)
+    return config
+
+def load_credentials(config, section='secrets'):
+    # Retrieve the secrets
+    credentials = {
+        'username': config.get(section, 'SFDC_USERNAME'),
+        'password': config.get(section, 'SFDC_PASSWORD'),
+        'security_token': config.get(section, 'SFDC_TOKEN')
+    }
+
+    # Raise an error if any of the secrets are missing
+    if not all(credentials.values()):
+        raise ValueError(f"One or more SFDC credentials are not set in the [{section}] section of the config file.")
+
+    return credentials
+
+# Record type of household accounts
+HOUSEHOLD_RECORD_TYPE_ID = '012d0000000W68QAAS'
+
+# Host of the Lightning links in exports
+LIGHTNING_HOST = 'rs.lightning.force.com'
+
+def make_org_profile(name, credentials, household_record_type_id=HOUSEHOLD_RECORD_TYPE_ID, lightning_host=LIGHTNING_HOST, routes=(), max_concurrency=None, max_requests_per_second=None):
+    return {
+        'name': name,
+        'credentials': credentials,
+        'household_record_type_id': household_record_type_id,
+        'lightning_host': lightning_host,
+        # Values of the routing column that belong to this org
+        'routes': set(routes),
+        'max_concurrency': max_concurrency,
+        'max_requests_per_second': max_requests_per_second,
+        # Opened by open_org_resources()
+        'session_manager': None,
+        'contact_cache': None
+    }
+
+def load_org_profiles(config_file_path='sfdc.ini'):
+    """ Read the orgs from the config file: [secrets] is the default org, each [org:<name>] section another one """
+    config = load_config(config_file_path)
+    sections = [('default', 'secrets')] if config.has_section('secrets') else []
+    sections += [(section.split(':', 1)[1], section) for section in config.sections() if section.startswith('org:')]
+    if not sections:
+        raise ValueError(f"No [secrets] or [org:<name>] section found in {config_file_path}.")
+
+    orgs = {}
+    for name, section in sections:
+        orgs[name] = make_org_profile(
+            name,
+            load_credentials(config, section),
+            household_record_type_id=config.get(section, 'HOUSEHOLD_RECORD_TYPE_ID', fallback=HOUSEHOLD_RECORD_TYPE_ID),
+            lightning_host=config.get(section, 'LIGHTNING_HOST', fallback=LIGHTNING_HOST),
+            routes=[value.strip() for value in config.get(section, 'ROUTES', fallback='').split(',') if value.strip()],
+            max_concurrency=config.getint(section, 'MAX_CONCURRENCY', fallback=None),
+            max_requests_per_second=config.getfloat(section, 'MAX_REQUESTS_PER_SECOND', fallback=None)
+        )
+    return orgs, config.get('routing', 'COLUMN', fallback=None)
+
+def org_path(path, org):
+    # Keep the configured path for the default org and add the org name for the others
+    if path is None or org['name'] == 'default':
+        return path
+    root, extension = os.path.splitext(path)
+    return f"{root}_{org['name']}{extension}"
+
+def file_prefix(options):
+    """ Prefix of export and result file names, so the files of different orgs can be told apart """
+    return '' if options.org['name'] == 'default' else options.org['name'] + '_'
+
+def open_org_resources(orgs, options):
+    """ Create the session manager and contact cache of each org """
+    for org in orgs.values():
+        concurrency = min(options.concurrency, org['max_concurrency'] or options.concurrency)
+        # Log in once for all actions, with a connection per worker thread
+        org['session_manager'] = SessionManager(org_path(options.session_cache, org), options.session_ttl, pool_size=max(10, concurrency * 2), requests_per_second=org['max_requests_per_second'])
+        if options.cache:
+            org['contact_cache'] = ContactCache(org_path(options.cache_path, org), options.cache_ttl, options.cache_max_entries)
+
+def org_options(options, org):
+    """ Copy the options for one org, applying its concurrency limit """
+    org_specific = argparse.Namespace(**vars(options))
+    org_specific.org = org
+    org_specific.session_manager = org['session_manager']
+    org_specific.contact_cache = org['contact_cache']
+    # Adaptive batch sizes by object and operation, kept for the whole action
+    org_specific.batch_size_controllers = {}
+    if org['max_concurrency']:
+        org_specific.concurrency = min(options.concurrency, org['max_concurrency'])
+    return org_specific
+
+def select_orgs(orgs, options, names=None):
+    """ Get the orgs to run, restricted by --org or by the org of a resumed job """
+    names = names or options.org_names or list(orgs)
+    unknown = [name for name in names if name not in orgs]
+    if unknown:
+        raise ValueError(f"Unknown org(s): {', '.join(unknown)}. Configured orgs: {', '.join(orgs)}.")
+    return [orgs[name] for name in names]
+
+def route_request(row, orgs, routing_column):
+    """ Get the name of the org a request belongs to, or None if no org matches """
+    if len(orgs) == 1:
+        return next(iter(orgs))
+    if routing_column is None:
+        raise ValueError("Several orgs are configured. Set COLUMN in the [routing] section of the config file to route the requests.")
+    if routing_column not in row:
+        raise ValueError(f"Missing routing column: {routing_column}")
+
+    value = (row[routing_column] or '').strip()
+    for name, org in orgs.items():
+        if value in org['routes']:
+            return name
+    # Never guess the org of a removal request
+    return None
+
+# Org name printed at the start of each output line while orgs run in parallel
+output_prefix = contextvars.ContextVar('output_prefix', default='')
+
+class PrefixedOutput:
+    """ Stdout wrapper writing whole lines, each prefixed with the output_prefix of the thread that printed it """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.lock = threading.Lock()
+        # Partial lines, so the lines of different threads aren't mixed up
+        self.pending = threading.local()
+
+    def write(self, text):
+        *lines, self.pending.text = (getattr(self.pending, 'text', '') + text).split('\n')
+        if lines:
+            prefix = output_prefix.get()
+            with self.lock:
+                self.stream.write(''.join(prefix + line + '\n' for line in lines))
+        return len(text)
+
+    def flush(self):
+        with self.lock:
+            self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+def submit_with_context(executor, func, *args):
+    """ Submit func to a thread pool with the caller's context, so the thread prints with the caller's org prefix """
+    return executor.submit(contextvars.copy_context().run, func, *args)
+
+def run_for_orgs(orgs, options, worker, *args):
+    """ Run worker(org, org_options, *args) for each org, concurrently when no prompts are shown """
+    if len(orgs) == 1 or options.interactive:
+        for org in orgs:
+            worker(org, org_options(options, org), *args)
+        return
+
+    def run_org(org):
+        output_prefix.set(f"[{org['name']}] ")
+        worker(org, org_options(options, org), *args)
+
+    print(f"Processing {len(orgs)} orgs in parallel: {', '.join(org['name'] for org in orgs)}.")
+    failed = []
+    with contextlib.redirect_stdout(PrefixedOutput(sys.stdout)), ThreadPoolExecutor(max_workers=len(orgs)) as executor:
+        futures = {org['name']: submit_with_context(executor, run_org, org) for org in orgs}
+        for name, future in futures.items():
+            try:
+                future.result()
+            except Exception:
+                # Let the other orgs finish before reporting
+                token = output_prefix.set(f"[{name}] ")
+                print("An error occurred:")
+                print(traceback.format_exc())
+                output_prefix.reset(token)
+                failed.append(name)
+    if failed:
+        raise RuntimeError(f"Processing failed for org(s): {', '.join(failed)}.")
+
+def create_rate_limited_adapter(requests_per_second, **kwargs):
+    """ Create an HTTP adapter that spaces out requests to stay under a per-org rate limit """
+    # Defined here so requests is only imported when connecting
+    from requests.adapters import HTTPAdapter
+
+    class RateLimitedAdapter(HTTPAdapter):
+        def __init__(self, requests_per_second, **kwargs):
+            super().__init__(**kwargs)
+            self.interval = 1 / requests_per_second
+            self.rate_lock = threading.Lock()
+            self.next_time = 0.0
+
+        def send(self, request, **kwargs):
+            with self.rate_lock:
+                now = time.monotonic()
+                wait = self.next_time - now
+                self.next_time = max(now, self.next_time) + self.interval
+            if wait > 0:
+                time.sleep(wait)
+            return super().send(request, **kwargs)
+
+    return RateLimitedAdapter(requests_per_second, **kwargs)
+
+class SessionManager:
+    """ Logs in to SFDC once and shares the session and its connection pool across actions """
+
+    def __init__(self, cache_path=None, ttl_minutes=60, pool_size=10, requests_per_second=None):
+        self.lock = threading.Lock()
+        self.credentials = None
+        self.sf = None
+        # Incremented on each login so concurrent callers re-authenticate only once
+        self.generation = 0
+        self.cache_path = cache_path
+        self.ttl_seconds = ttl_minutes * 60
+        self.pool_size = pool_size
+        self.requests_per_second = requests_per_second
+
+    def connect(self, credentials):
+        import requests
+        from simple_salesforce import Salesforce
+
+        with self.lock:
+            if self.sf is not None and credentials == self.credentials:
+                print('Reusing the SFDC session.')
+                return self.sf
+
+            self.credentials = credentials
+            # One pooled HTTP session for the REST and Bulk API calls of all worker threads
+            http_session = requests.Session()
+            if self.requests_per_second:
+                adapter = create_rate_limited_adapter(self.requests_per_second, pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+            else:
+                adapter = requests.adapters.HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+            http_session.mount('https://', adapter)
+
+            cached_session = self.load_cached_session()
+            if cached_session is not None:
+                print('Using the cached SFDC session.')
+                session_id, instance = cached_session
+            else:
+                session_id, instance = self.login(http_session)
+            self.sf = Salesforce(session_id=session_id, instance=instance, session=http_session)
+            return self.sf
+
+    def login(self, http_session):
+        from simple_salesforce import SalesforceLogin
+
+        session_id, instance = SalesforceLogin(session=http_session, **self.credentials)
+        self.generation += 1
+        self.save_cached_session(session_id, instance)
+        return session_id, instance
+
+    def refresh(self, generation):
+        """ Log in again after the session expired, unless another thread already did """
+        with self.lock:
+            if generation != self.generation:
+                return
+            print('The SFDC session expired. Logging in again.')
+            session_id, instance = self.login(self.sf.session)
+            self.sf.session_id = session_id
+            self.sf.headers['Authorization'] = 'Bearer ' + session_id
+
+    def load_cached_session(self):
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return None
+        with open(self.cache_path, encoding='utf-8') as f:
+            cached = json.load(f)
+        if cached['username'] != self.credentials['username'] or cached['expires_at'] < time.time():
+            return None
+        return cached['session_id'], cached['instance']
+
+    def save_cached_session(self, session_id, instance):
+        if not self.cache_path:
+            return
+        os.makedirs(os.path.dirname(self.cache_path) or '.', exist_ok=True)
+        # The session id grants access to the org, keep it readable by the owner only
+        fd = os.open(self.cache_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump({
+                'username': self.credentials['username'],
+                'instance': instance,
+                'session_id': session_id,
+                'expires_at': time.time() + self.ttl_seconds
+            }, f)
+
+def is_expired_session(error):
+    from simple_salesforce import SalesforceExpiredSession
+
+    # REST calls raise SalesforceExpiredSession, Bulk API calls report InvalidSessionId in the error body
+    return isinstance(error, SalesforceExpiredSession) or 'INVALID_SESSION_ID' in str(error) or 'InvalidSessionId' in str(error)
+
+def connect_to_sfdc(options):
+    with run_report.stage('login', org=options.org['name']):
+        sf = options.session_manager.connect(options.org['credentials'])
+    run_report.attach(sf, options.org['name'])
+    return sf
+
+def ask_for_file():
+    # Imported here so headless runs never start Tk
+    import tkinter as tk
+    from tkinter import filedialog
+
+    root = tk.Tk()
+    root.withdraw()
+    file_path = filedialog.askopenfilename()
+    root.destroy()
+    return file_path
+
+def pause(message, options):
+    # Only wait for the user in interactive mode
+    if options.interactive:
+        input(message)
+
+class RunReport:
+    """ Collects the stage timings, record counts and API usage of an action """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Seconds from the first import to the start of main(), set once per process
+        self.startup_seconds = None
+        self.reset(None)
+
+    def reset(self, action):
+        with self.lock:
+            self.action = action
+            self.started_at = datetime.datetime.now(datetime.timezone.utc)
+            self.start = time.perf_counter()
+            self.events = []
+            self.counters = collections.Counter()
+            # Connections by org name, to read their API limits at the end
+            self.connections = {}
+
+    @contextlib.contextmanager
+    def stage(self, name, **details):
+        """ Time a stage; details added to the yielded dict are recorded with it """
+        start = time.perf_counter()
+        try:
+            yield details
+        finally:
+            self.add_event(name, time.perf_counter() - start, **details)
+
+    def add_event(self, name, seconds, **details):
+        with self.lock:
+            self.events.append(dict(stage=name, seconds=round(seconds, 4), **details))
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+
+    def attach(self, sf, org_name='default'):
+        # Count every HTTP request made through the shared session, REST and Bulk alike
+        with self.lock:
+            self.connections[org_name] = sf
+        if self.count_api_call not in sf.session.hooks['response']:
+            sf.session.hooks['response'].append(self.count_api_call)
+
+    def count_api_call(self, response, *args, **kwargs):
+        self.count('api_calls')
+
+    def api_limits(self):
+        limits = {}
+        for org_name, sf in self.connections.items():
+            try:
+                daily = sf.limits()['DailyApiRequests']
+            except Exception:
+                continue
+            limits[org_name] = {'max': daily['Max'], 'remaining': daily['Remaining']}
+        return limits
+
+    def summary(self):
+        stages = {}
+        for event in self.events:
+            totals = stages.setdefault(event['stage'], {'count': 0, 'total_seconds': 0.0, 'max_seconds': 0.0})
+            totals['count'] += 1
+            totals['total_seconds'] = round(totals['total_seconds'] + event['seconds'], 4)
+            totals['max_seconds'] = max(totals['max_seconds'], event['seconds'])
+        return {
+            'action': self.action,
+            'started_at': self.started_at.isoformat(),
+            'duration_seconds': round(time.perf_counter() - self.start, 4),
+            'startup_seconds': self.startup_seconds,
+            'counters': dict(self.counters),
+            'stages': stages,
+            'daily_api_requests': self.api_limits(),
+            'events': self.events
+        }
+
+def write_prometheus_textfile(summary, path):
+    """ Write the run summary in the Prometheus textfile collector format """
+    labels = f'action="{summary["action"]}"'
+    lines = [
+        '# HELP sfdc_removal_run_duration_seconds Duration of the last run.',
+        '# TYPE sfdc_removal_run_duration_seconds gauge',
+        f'sfdc_removal_run_duration_seconds{{{labels}}} {summary["duration_seconds"]}',
+        '# HELP sfdc_removal_last_run_timestamp_seconds Start time of the last run.',
+        '# TYPE sfdc_removal_last_run_timestamp_seconds gauge',
+        f'sfdc_removal_last_run_timestamp_seconds{{{labels}}} {datetime.datetime.fromisoformat(summary["started_at"]).timestamp()}',
+        '# HELP sfdc_removal_count Records and API calls counted during the last run.',
+        '# TYPE sfdc_removal_count gauge'
+    ]
+    lines += [f'sfdc_removal_count{{{labels},name="{name}"}} {value}' for name, value in sorted(summary['counters'].items())]
+    lines += [
+        '# HELP sfdc_removal_stage_seconds Time spent per stage during the last run.',
+        '# TYPE sfdc_removal_stage_seconds gauge'
+    ]
+    lines += [f'sfdc_removal_stage_seconds{{{labels},stage="{stage}"}} {totals["total_seconds"]}' for stage, totals in sorted(summary['stages'].items())]
+    if summary['startup_seconds'] is not None:
+        lines += [
+            '# HELP sfdc_removal_startup_seconds Time from the first import to the start of the tool.',
+            '# TYPE sfdc_removal_startup_seconds gauge',
+            f'sfdc_removal_startup_seconds{{{labels}}} {summary["startup_seconds"]}'
+        ]
+    if summary['daily_api_requests']:
+        lines += [
+            '# HELP sfdc_removal_daily_api_requests_remaining Remaining daily API requests of the org.',
+            '# TYPE sfdc_removal_daily_api_requests_remaining gauge'
+        ]
+        lines += [f'sfdc_removal_daily_api_requests_remaining{{org="{org_name}"}} {limits["remaining"]}' for org_name, limits in sorted(summary['daily_api_requests'].items())]
+        lines += [
+            '# HELP sfdc_removal_daily_api_requests_max Daily API request limit of the org.',
+            '# TYPE sfdc_removal_daily_api_requests_max gauge'
+        ]
+        lines += [f'sfdc_removal_daily_api_requests_max{{org="{org_name}"}} {limits["max"]}' for org_name, limits in sorted(summary['daily_api_requests'].items())]
+
+    # The collector may read at any time, so replace the file in one step
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines) + '\n')
+    os.replace(path + '.tmp', path)
+
+# Report of the action that is currently running
+run_report = RunReport()
+
+def write_run_report(options):
+    summary = run_report.summary()
+    os.makedirs('reports', exist_ok=True)
+    report_path = 'reports/run_' + summary['action'] + '_' + new_run_id() + '.json'
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(summary, f, indent=2)
+    if options.prometheus_textfile:
+        write_prometheus_textfile(summary, options.prometheus_textfile)
+
+    # Point at the slowest stages
+    slowest = sorted(summary['stages'].items(), key=lambda item: item[1]['total_seconds'], reverse=True)[:3]
+    print(f"Run report written to {report_path}. {summary['counters'].get('api_calls', 0)} API call(s) in {summary['duration_seconds']:.1f}s.")
+    if slowest:
+        print('Slowest stages: ' + ', '.join(f"{stage} {totals['total_seconds']:.1f}s" for stage, totals in slowest) + '.')
+    for org_name, limits in summary['daily_api_requests'].items():
+        print(f"Daily API requests remaining in the {org_name} org: {limits['remaining']} of {limits['max']}.")
+
+def run_action(options, action, handler, *args, **kwargs):
+    """ Run a handler and write its run report, even if it fails """
+    run_report.reset(action)
+    try:
+        return handler(*args, **kwargs)
+    finally:
+        write_run_report(options)
+
+# Bulk API 1.0 accepts at most 10,000 records per batch
+MAX_BATCH_SIZE = 10000
+
+def batch_size_type(value):
+    value = int(value)
+    if not 1 <= value <= MAX_BATCH_SIZE:
+        raise argparse.ArgumentTypeError(f"Batch size must be between 1 and {MAX_BATCH_SIZE}.")
+    return value
+
+def positive_int_type(value):
+    value = int(value)
+    if value < 1:
+        raise argparse.ArgumentTypeError("Value must be at least 1.")
+    return value
+
+def child_object_type(value):
+    if '.' not in value:
+        raise argparse.ArgumentTypeError("Use OBJECT.RELATIONSHIP, e.g. Survey__c.Contact__r.")
+    return value
+
+# Errors caused by contention or load rather than by the record itself
+RETRYABLE_ERRORS = ('UNABLE_TO_LOCK_ROW', 'REQUEST_RUNNING_TOO_LONG', 'SERVER_UNAVAILABLE', 'Max CPU time exceeded')
+
+def is_retryable_error(result_item):
+    # Household accounts are shared by several contacts, so parallel batches can collide on them
+    errors = str(result_item.get('errors'))
+    return not result_item['success'] and any(error in errors for error in RETRYABLE_ERRORS)
+
+def iter_batches(records, batch_size):
+    """ Take batches from an iterable; batch_size can be a callable returning the size of the next batch """
+    records = iter(records)
+    while True:
+        batch = list(itertools.islice(records, batch_size() if callable(batch_size) else batch_size))
+        if not batch:
+            return
+        yield batch
+
+def backoff_delay(options, attempt):
+    # Exponential backoff with jitter so parallel workers don't retry in lockstep
+    return options.retry_delay * 2 ** (attempt - 1) * (0.5 + secrets.randbelow(1000) / 1000)
+
+def call_with_retries(func, options, description):
+    """ Call func, retrying with exponential backoff when it raises """
+    for attempt in itertools.count(1):
+        session_manager = options.session_manager
+        generation = session_manager.generation if session_manager is not None else None
+        try:
+            return func()
+        except Exception as e:
+            if attempt > options.max_retries:
+                raise
+            if is_expired_session(e) and session_manager is not None and session_manager.sf is not None:
+                # Log in again and retry right away
+                session_manager.refresh(generation)
+                continue
+            delay = backoff_delay(options, attempt)
+            print(f"{description} failed ({e}). Retrying in {delay:.1f}s, attempt {attempt} of {options.max_retries}.")
+            run_report.count('retries')
+            time.sleep(delay)
+
+class AdaptiveBatchSize:
+    """ Grows the batch size while batches succeed quickly and shrinks it on lock and timeout errors """
+
+    def __init__(self, initial, minimum=200, maximum=MAX_BATCH_SIZE, target_seconds=60):
+        self.size = initial
+        self.minimum = min(minimum, initial)
+        self.maximum = maximum
+        self.target_seconds = target_seconds
+        self.lock = threading.Lock()
+
+    def __call__(self):
+        with self.lock:
+            return self.size
+
+    def record(self, batch_size, result, seconds):
+        retryable = sum(1 for item in result if is_retryable_error(item))
+        with self.lock:
+            if retryable > len(result) * 0.01 or seconds > self.target_seconds * 2:
+                # Contention or slow batches, back off quickly
+                self.size = max(self.minimum, self.size // 2)
+            elif retryable == 0 and seconds < self.target_seconds and batch_size >= self.size:
+                # Only grow on batches that were as large as the current size
+                self.size = min(self.maximum, int(self.size * 1.5))
+
+def get_batch_size(options, object_name, operation):
+    """ Get the batch size of a bulk operation, or its shared controller with --adaptive-batch-size """
+    if not options.adaptive_batch_size:
+        return options.batch_size
+    # Shared by all the chunks of the action, so what it learns carries over between them
+    return options.batch_size_controllers.setdefault((object_name, operation), AdaptiveBatchSize(options.batch_size))
+
+def submit_bulk(sf, object_name, operation, records, options):
+    """ Submit records to the Bulk API in parallel batches and return one result per record """
+    batch_size = get_batch_size(options, object_name, operation)
+
+    def bulk_call(batch, use_serial):
+        # Each call is one Bulk API job
+        with run_report.stage('bulk_job', object=object_name, operation=operation, records=len(batch), serial=use_serial) as details:
+            start = time.perf_counter()
+            batch_result = call_with_retries(
+                # Look up the handler on each attempt, it carries the current session id
+                lambda: getattr(getattr(sf.bulk, object_name), operation)(batch, batch_size=len(batch), use_serial=use_serial),
+                options,
+                f'{object_name} {operation} batch'
+            )
+            details['failed'] = sum(1 for item in batch_result if not item['success'])
+        if callable(batch_size):
+            batch_size.record(len(batch), batch_result, time.perf_counter() - start)
+        run_report.count('bulk_jobs')
+        run_report.count('records_submitted', len(batch))
+        run_report.count('records_failed', details['failed'])
+        return batch_result
+
+    # Records can be any iterable, batches are taken from it as they are submitted
+    batches = iter_batches(records, batch_size)
+
+    if options.backend == 'bulk2' and not options.serial:
+        # Bulk API 2.0 splits and parallelizes the job server-side
+        records = list(records)
+        if not records:
+            return []
+        result = submit_bulk2(sf, object_name, operation, records)
+    else:
+        # Submit one batch per worker, at most `concurrency` at a time
+        records = []
+        result = []
+        in_flight = collections.deque()
+        max_in_flight = 1 if options.serial else options.concurrency
+        with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+            for batch in batches:
+                if len(in_flight) >= max_in_flight:
+                    result += in_flight.popleft().result()
+                records += batch
+                in_flight.append(submit_with_context(executor, bulk_call, batch, options.serial))
+            while in_flight:
+                result += in_flight.popleft().result()
+
+    # Retry only the records that failed with lock or timeout errors, in serial jobs with a growing delay
+    for attempt in range(1, options.max_retries + 1):
+        retry_indexes = [i for i, item in enumerate(result) if is_retryable_error(item)]
+        if not retry_indexes:
+            break
+        delay = backoff_delay(options, attempt)
+        print(f"Retrying {len(retry_indexes)} record(s) that failed with lock or timeout errors in {delay:.1f}s, attempt {attempt} of {options.max_retries}.")
+        run_report.count('retries')
+        time.sleep(delay)
+        retry_result = []
+        for batch in iter_batches([records[i] for i in retry_indexes], batch_size):
+            retry_result += bulk_call(batch, True)
+        for i, item in zip(retry_indexes, retry_result):
+            result[i] = item
+
+    return result
+
+def bulk2_results_to_items(successful_csv, failed_csv):
+    # Convert Bulk API 2.0 result CSVs to the Bulk API 1.0 result format
+    result = []
+    for row in csv.DictReader(io.StringIO(successful_csv)):
+        result.append({'success': True, 'created': row.get('sf__Created') == 'true', 'id': row.get('sf__Id'), 'errors': []})
+    for row in csv.DictReader(io.StringIO(failed_csv)):
+        error = row.get('sf__Error', '')
+        result.append({
+            'success': False,
+            'created': False,
+            'id': row.get('sf__Id') or row.get('Id'),
+            'errors': [{'statusCode': error.split(':')[0], 'message': error}]
+        })
+    return result
+
+def submit_bulk2(sf, object_name, operation, records):
+    """ Submit records as Bulk API 2.0 ingest jobs and return one result per record, in order """
+    bulk2_type = getattr(sf.bulk2, object_name)
+    with run_report.stage('bulk2_job', object=object_name, operation=operation, records=len(records)):
+        jobs = getattr(bulk2_type, operation)(records=records)
+    run_report.count('bulk_jobs', len(jobs))
+    run_report.count('records_submitted', len(records))
+
+    items_by_id = {}
+    for job in jobs:
+        for item in bulk2_results_to_items(
+            bulk2_type.get_successful_records(job['job_id']),
+            bulk2_type.get_failed_records(job['job_id'])
+        ):
+            items_by_id[item['id']] = item
+
+    # Return the results in the same order as the records
+    return [items_by_id.get(record['Id'], {'success': False, 'created': False, 'id': record['Id'], 'errors': ['No result returned.']}) for record in records]
+
+def bulk2_delete_from_query(sf, object_name, query, name, operation='delete'):
+    """ Stream the Ids returned by a query to disk and delete them with Bulk API 2.0 """
+    bulk2_type = getattr(sf.bulk2, object_name)
+
+    # Download the Ids as CSV pages without loading them into memory
+    export_dir = 'exports/' + name + '_' + new_run_id()
+    os.makedirs(export_dir, exist_ok=True)
+    with run_report.stage('bulk2_query', object=object_name) as details:
+        pages = bulk2_type.download(query, path=export_dir)
+        details['records'] = sum(page['number_of_records'] for page in pages)
+    run_report.count('records_queried', details['records'])
+    print(f"{sum(page['number_of_records'] for page in pages)} record(s) found. Exported to {export_dir}.")
+
+    # Feed each page into an ingest job
+    ok_count = 0
+    fail_count = 0
+    results_writer = ResultsWriter(name, object_name, operation)
+    for page in pages:
+        if page['number_of_records'] == 0:
+            continue
+        with run_report.stage('bulk2_job', object=object_name, operation=operation, records=page['number_of_records']):
+            jobs = getattr(bulk2_type, operation)(csv_file=page['file'])
+        run_report.count('records_submitted', page['number_of_records'])
+        for job in jobs:
+            run_report.count('bulk_jobs')
+            run_report.count('records_failed', job['numberRecordsFailed'])
+            ok_count += job['numberRecordsProcessed'] - job['numberRecordsFailed']
+            fail_count += job['numberRecordsFailed']
+            # Keep the failed records on disk for follow-up
+            if job['numberRecordsFailed'] > 0:
+                failed = bulk2_results_to_items('', bulk2_type.get_failed_records(job['job_id']))
+                results_writer.write([{'Id': item['id']} for item in failed], failed)
+    results_writer.close()
+
+    success_emoji = '✔️' if fail_count == 0 else '💥'
+    print("OK: " + str(ok_count) + ", Fail: " + str(fail_count) + '. ' + success_emoji)
+
+    return [page['file'] for page in pages]
+
+def iter_ids_from_files(file_paths):
+    # Read the Id column of downloaded CSV pages one row at a time
+    for file_path in file_paths:
+        with open(file_path, newline='', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                yield row['Id']
+
+# Records per page of REST queries and of Bulk API 2.0 query downloads
+QUERY_PAGE_SIZE = 2000
+BULK2_QUERY_PAGE_SIZE = 50000
+
+# REST queries are sent as GET requests and Salesforce rejects URIs over 16,384 bytes
+MAX_QUERY_URL_LENGTH = 16000
+
+def soql_quote(value):
+    # Escape backslashes and apostrophes for a SOQL string literal
+    return "'" + str(value).replace('\\', '\\\\').replace("'", "\\'") + "'"
+
+def plan_in_clause_queries(query_template, values, max_length=MAX_QUERY_URL_LENGTH):
+    """ Fill the {0} IN list of a query template, splitting values so each query stays under the URL length limit """
+    # Measure the URL-encoded UTF-8 length, which is what counts against the limit
+    base_length = len(quote_plus(query_template.format('')))
+    comma_length = len(quote_plus(','))
+
+    chunks = []
+    chunk = []
+    chunk_length = base_length
+    for value in values:
+        quoted = soql_quote(value)
+        value_length = len(quote_plus(quoted)) + comma_length
+        if chunk and chunk_length + value_length > max_length:
+            chunks.append(chunk)
+            chunk = []
+            chunk_length = base_length
+        chunk.append(quoted)
+        chunk_length += value_length
+    if chunk:
+        chunks.append(chunk)
+
+    return [query_template.format(','.join(chunk)) for chunk in chunks]
+
+def run_queries(sf, queries, options, read_ahead=True):
+    """ Run queries at most `concurrency` at a time and yield their results in order.
+    Without read_ahead, no query runs while the caller handles a result, so the caller's own API calls stay within `concurrency` too """
+    with ThreadPoolExecutor(max_workers=options.concurrency) as executor:
+        in_flight = collections.deque()
+        for query in queries:
+            if len(in_flight) >= options.concurrency:
+                yield from take_query_results(in_flight, read_ahead)
+            in_flight.append(submit_with_context(executor, timed_query, sf, query, options))
+        while in_flight:
+            yield from take_query_results(in_flight, read_ahead)
+
+def take_query_results(in_flight, read_ahead):
+    if read_ahead:
+        return [in_flight.popleft().result()]
+    results = [future.result() for future in in_flight]
+    in_flight.clear()
+    return results
+
+def timed_query(sf, query, options):
+    with run_report.stage('soql_query') as details:
+        data = call_with_retries(lambda: sf.query_all(query), options, 'Query')
+        details['records'] = len(data['records'])
+    run_report.count('soql_queries')
+    run_report.count('records_queried', len(data['records']))
+    return data
+
+def iter_query(sf, query, options):
+    """ Yield the records of a query page by page, retrying each page """
+    data = call_with_retries(lambda: sf.query(query), options, 'Query')
+    while True:
+        yield from data['records']
+        if data['done']:
+            return
+        next_records_url = data['nextRecordsUrl']
+        data = call_with_retries(lambda: sf.query_more(next_records_url, identifier_is_url=True), options, 'Query')
+
+def normalize_email(email):
+    return str(email).strip().lower()
+
+EMAIL_PATTERN = re.compile(r'^[^@\s]+@[^@\s]+\.[^@\s]+$')
+
+def build_email_index(emails):
+    """ Normalize, validate and deduplicate email addresses, returning the unique ones and a report """
+    unique_emails = {}
+    report = {'total': 0, 'duplicates': 0, 'blank': 0, 'rejected': []}
+    for email in emails:
+        report['total'] += 1
+        normalized = normalize_email(email)
+        if not normalized:
+            report['blank'] += 1
+        elif not EMAIL_PATTERN.match(normalized):
+            report['rejected'].append(email)
+        elif normalized in unique_emails:
+            report['duplicates'] += 1
+        else:
+            unique_emails[normalized] = None
+    report['unique'] = len(unique_emails)
+    return list(unique_emails), report
+
+def print_email_report(report, name):
+    print(f"{report['total']} email address(es): {report['unique']} unique, {report['duplicates']} duplicate(s) collapsed, {report['blank']} blank, {len(report['rejected'])} invalid.")
+
+    # Export the rejected addresses for review
+    if report['rejected']:
+        print('Exporting the invalid email addresses.')
+        os.makedirs('exports', exist_ok=True)
+        with open(r'exports/' + name + '_invalid_emails_' + new_run_id() + '.csv', 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(['Email'])
+            writer.writerows([email] for email in report['rejected'])
+
+CONTACT_QUERY = "SELECT Id, Email, GDPR__c, HasOptedOutOfEmail, Marketing_Status__c, AccountId, Account.RecordTypeId, Account.GDPR_Account__c FROM Contact WHERE Email IN ({0})"
+
+class ContactCache:
+    """ On-disk cache of email address to Contact Id, AccountId, account RecordTypeId and the GDPR and unsubscribe flags """
+
+    # SQLite limits the number of parameters per statement
+    CHUNK_SIZE = 500
+
+    # Cached columns of the flags pushed by the tool, with the Id column of each object
+    FLAG_COLUMNS = {
+        'Contact': ('contact_id', {'GDPR__c': 'gdpr', 'HasOptedOutOfEmail': 'opted_out', 'Marketing_Status__c': 'marketing_status'}),
+        'Account': ('account_id', {'GDPR_Account__c': 'account_gdpr'})
+    }
+
+    def __init__(self, path, ttl_hours=24, max_entries=500000):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.ttl_seconds = ttl_hours * 3600
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        # Caches written without the flags would read as not flagged, so start them over
+        existing_columns = {row[1] for row in self.connection.execute("PRAGMA table_info(contacts)")}
+        if existing_columns and 'account_gdpr' not in existing_columns:
+            with self.connection:
+                self.connection.execute("DROP TABLE contacts")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS contacts (
+                email TEXT NOT NULL,
+                contact_id TEXT NOT NULL,
+                account_id TEXT,
+                record_type_id TEXT,
+                gdpr INTEGER NOT NULL,
+                opted_out INTEGER NOT NULL,
+                marketing_status TEXT,
+                account_gdpr INTEGER NOT NULL,
+                cached_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self.connection.execute("CREATE INDEX IF NOT EXISTS contacts_email ON contacts (email)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS contacts_contact_id ON contacts (contact_id)")
+        # Drop expired entries
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM contacts WHERE cached_at < ?", (time.time() - self.ttl_seconds,))
+
+    def get(self, emails):
+        """ Return the cached contact records and the email addresses that were not found """
+        emails = list(dict.fromkeys(normalize_email(email) for email in emails))
+        now = time.time()
+        records = []
+        found = set()
+        with self.lock, self.connection:
+            for i in range(0, len(emails), self.CHUNK_SIZE):
+                chunk = emails[i:i + self.CHUNK_SIZE]
+                placeholders = ','.join('?' * len(chunk))
+                rows = self.connection.execute(
+                    f"SELECT email, contact_id, account_id, record_type_id, gdpr, opted_out, marketing_status, account_gdpr FROM contacts WHERE email IN ({placeholders}) AND cached_at >= ?",
+                    chunk + [now - self.ttl_seconds]
+                ).fetchall()
+                for email, contact_id, account_id, record_type_id, gdpr, opted_out, marketing_status, account_gdpr in rows:
+                    found.add(email)
+                    # Same shape as the CONTACT_QUERY records
+                    records.append({
+                        'Id': contact_id,
+                        'Email': email,
+                        'GDPR__c': bool(gdpr),
+                        'HasOptedOutOfEmail': bool(opted_out),
+                        'Marketing_Status__c': marketing_status,
+                        'AccountId': account_id,
+                        'Account': {'RecordTypeId': record_type_id, 'GDPR_Account__c': bool(account_gdpr)} if account_id else None
+                    })
+                self.connection.execute(f"UPDATE contacts SET last_used = ? WHERE email IN ({placeholders})", [now] + chunk)
+        return records, [email for email in emails if email not in found]
+
+    def put(self, records):
+        """ Store the contacts returned by a query, replacing older entries for the same email addresses """
+        now = time.time()
+        rows = []
+        for record in records:
+            account = record.get('Account') or {}
+            rows.append((
+                normalize_email(record['Email']), record['Id'], record.get('AccountId'), account.get('RecordTypeId'),
+                record.get('GDPR__c') is True, record.get('HasOptedOutOfEmail') is True, record.get('Marketing_Status__c'), account.get('GDPR_Account__c') is True,
+                now, now
+            ))
+        if not rows:
+            return
+        with self.lock, self.connection:
+            self.connection.executemany("DELETE FROM contacts WHERE email = ?", set((row[0],) for row in rows))
+            self.connection.executemany("INSERT INTO contacts VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            # Evict the least recently used email addresses
+            excess = self.connection.execute("SELECT COUNT(DISTINCT email) FROM contacts").fetchone()[0] - self.max_entries
+            if excess > 0:
+                self.connection.execute(
+                    "DELETE FROM contacts WHERE email IN (SELECT email FROM contacts GROUP BY email ORDER BY MAX(last_used) LIMIT ?)",
+                    (excess,)
+                )
+
+    def update_flags(self, object_name, record_ids, values):
+        """ Store the flags pushed to contacts or their accounts, so cached contacts aren't updated again """
+        id_column, field_columns = self.FLAG_COLUMNS.get(object_name, (None, {}))
+        assignments = {field_columns[field]: value for field, value in values.items() if field in field_columns}
+        if not assignments:
+            return
+        set_clause = ', '.join(f"{column} = ?" for column in assignments)
+        record_ids = iter(record_ids)
+        with self.lock, self.connection:
+            while True:
+                chunk = list(itertools.islice(record_ids, self.CHUNK_SIZE))
+                if not chunk:
+                    break
+                self.connection.execute(
+                    f"UPDATE contacts SET {set_clause} WHERE {id_column} IN ({','.join('?' * len(chunk))})",
+                    list(assignments.values()) + chunk
+                )
+
+    def invalidate_contacts(self, contact_ids):
+        """ Remove deleted contacts from the cache """
+        contact_ids = iter(contact_ids)
+        with self.lock, self.connection:
+            while True:
+                chunk = list(itertools.islice(contact_ids, self.CHUNK_SIZE))
+                if not chunk:
+                    break
+                self.connection.execute(f"DELETE FROM contacts WHERE contact_id IN ({','.join('?' * len(chunk))})", chunk)
+
+class RequestLedger:
+    """ On-disk ledger of the OneTrust requests handled by earlier runs """
+
+    # SQLite limits the number of parameters per statement
+    CHUNK_SIZE = 500
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        # The primary key doubles as the index for lookups
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS requests (
+                org TEXT NOT NULL,
+                request_type TEXT NOT NULL,
+                request_key TEXT NOT NULL,
+                status TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (org, request_type, request_key)
+            ) WITHOUT ROWID
+        """)
+
+    def processed(self, org_name, request_type, request_keys):
+        """ Return the keys of the requests that were processed successfully before """
+        request_keys = list(dict.fromkeys(request_keys))
+        found = set()
+        with self.lock:
+            for i in range(0, len(request_keys), self.CHUNK_SIZE):
+                chunk = request_keys[i:i + self.CHUNK_SIZE]
+                rows = self.connection.execute(
+                    f"SELECT request_key FROM requests WHERE org = ? AND request_type = ? AND status = 'done' AND request_key IN ({','.join('?' * len(chunk))})",
+                    [org_name, request_type] + chunk
+                ).fetchall()
+                found.update(row[0] for row in rows)
+        return found
+
+    def record(self, org_name, request_type, request_keys, status):
+        now = time.time()
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO requests VALUES (?, ?, ?, ?, ?)",
+                ((org_name, request_type, request_key, status, now) for request_key in dict.fromkeys(request_keys))
+            )
+
+def plan_contact_lookup(emails, options):
+    """ Split email addresses into cached contacts and the queries needed for the rest """
+    if options.contact_cache is None:
+        return [], plan_in_clause_queries(CONTACT_QUERY, emails)
+
+    with run_report.stage('cache_lookup', emails=len(emails)):
+        cached_records, missing_emails = options.contact_cache.get(emails)
+    run_report.count('cache_hits', len(emails) - len(missing_emails))
+    print(f"{len(cached_records)} contact(s) found in the cache. {len(missing_emails)} email address(es) left to query.")
+    return cached_records, plan_in_clause_queries(CONTACT_QUERY, missing_emails)
+
+def run_contact_queries(sf, queries, options, read_ahead=True):
+    """ Run contact queries and add their results to the cache """
+    for data in run_queries(sf, queries, options, read_ahead):
+        if options.contact_cache is not None:
+            options.contact_cache.put(data['records'])
+        yield data
+
+def lookup_contacts(sf, emails, options):
+    """ Get the contacts for a list of email addresses, querying SFDC only for cache misses """
+    cached_records, queries = plan_contact_lookup(emails, options)
+    records = list(cached_records)
+    for data in run_contact_queries(sf, queries, options):
+        records += data['records']
+    return records
+
+def query_contacts_by_request_type(sf, email_lists, options):
+    """ Query the contacts for all request types at once and partition them locally by request type """
+    # Index normalized email addresses by request type
+    email_index = {}
+    for request_type, email_list in email_lists.items():
+        for email in email_list:
+            email_index.setdefault(normalize_email(email), set()).add(request_type)
+
+    # Email comparisons in SOQL are case-insensitive, so the normalized addresses match the same contacts
+    records_by_type = {request_type: [] for request_type in email_lists}
+    for record in lookup_contacts(sf, list(email_index), options):
+        for request_type in email_index.get(normalize_email(record['Email']), ()):
+            records_by_type[request_type].append(record)
+
+    return records_by_type
+
+def new_run_id():
+    # Timestamp for sorting plus a random suffix, so files written in the same second don't collide
+    return datetime.datetime.today().strftime('%Y-%m-%d-%H-%M-%S') + '-' + secrets.token_hex(3)
+
+def json_default(value):
+    # numpy scalars end up in payloads built from arrays
+    return value.item() if hasattr(value, 'item') else str(value)
+
+class JobJournal:
+    """ Append-only checkpoint log recording the completed chunks and stages of a job so it can be resumed """
+
+    def __init__(self, path, data):
+        self.path = path
+        self.data = data
+
+    @classmethod
+    def create(cls, command, job_input):
+        job_id = new_run_id()
+        journal = cls(os.path.join('jobs', job_id + '.jsonl'), {
+            'job_id': job_id,
+            'command': command,
+            'input': job_input,
+            'status': 'running',
+            'steps': {}
+        })
+        os.makedirs('jobs', exist_ok=True)
+        journal.append({key: value for key, value in journal.data.items() if key != 'steps'})
+        print(f"Started job {job_id}. If it is interrupted, rerun with --resume {job_id} to continue.")
+        return journal
+
+    @classmethod
+    def load(cls, job_id):
+        path = os.path.join('jobs', job_id + '.jsonl')
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"No journal found for job {job_id}.")
+        with open(path, 'rb+') as f:
+            content = f.read()
+            # A crash can only leave the last line half-written. Cut it off, or the next entry
+            # would be appended to it and both would be lost
+            complete_length = content.rfind(b'\n') + 1
+            if complete_length < len(content):
+                f.truncate(complete_length)
+        lines = content[:complete_length].decode('utf-8').splitlines()
+        if not lines:
+            raise ValueError(f"The journal of job {job_id} is empty.")
+
+        # Replay the log
+        data = dict(json.loads(lines[0]), steps={})
+        for line in lines[1:]:
+            entry = json.loads(line)
+            if 'step' in entry:
+                data['steps'].setdefault(entry['step'], {}).update(entry['values'])
+            else:
+                data.update(entry)
+        return cls(path, data)
+
+    def step(self, key):
+        return self.data['steps'].get(key, {})
+
+    def update(self, key, **values):
+        self.data['steps'].setdefault(key, {}).update(values)
+        self.append({'step': key, 'values': values})
+
+    def record_error(self, key, error):
+        """ Mark a stage as failed so a resumed run submits it again """
+        print(f"Stage {key} failed: {error}")
+        self.update(key, status='error', error=f'{type(error).__name__}: {error}')
+
+    def finish(self):
+        failed_steps = [key for key, step in self.data['steps'].items() if step.get('status') == 'error']
+        if failed_steps:
+            self.set(status='incomplete')
+            print(f"Job {self.data['job_id']} finished with {len(failed_steps)} failed stage(s): {', '.join(failed_steps)}. Rerun with --resume {self.data['job_id']} to retry them.")
+            return
+        self.set(status='completed')
+        print(f"Job {self.data['job_id']} completed.")
+
+    def set(self, **values):
+        """ Set job-level values, like the planned queries or the status """
+        self.data.update(values)
+        self.append(values)
+
+    def append(self, entry):
+        # Only the new entry is written, so checkpoints stay cheap as the job grows
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, default=json_default) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+def check_job_completed(journal, options):
+    """ Fail headless runs whose job has failed stages, so schedulers notice """
+    if journal.data.get('status') == 'incomplete' and not options.interactive:
+        raise RuntimeError(f"Job {journal.data['job_id']} is incomplete. Rerun with --resume {journal.data['job_id']} to retry the failed stages.")
+
+def resume_journal(options, command):
+    """ Load the journal of the job passed with --resume, if any """
+    if not options.resume:
+        return None
+
+    journal = JobJournal.load(options.resume)
+    # Only resume once, later menu actions start new jobs
+    options.resume = None
+    if journal.data['command'] != command:
+        raise ValueError(f"Job {journal.data['job_id']} was started by the '{journal.data['command']}' command, not '{command}'.")
+    print(f"Resuming job {journal.data['job_id']}.")
+    return journal
+
+def print_result_summary(result):
+    # Print success count
+    success_list = [1 if d['success'] is True else 0 for d in result]
+    success_emoji = '✔️' if (len(success_list) - sum(success_list)) == 0 else '💥'
+    print("OK: " + str(sum(success_list)) + ", Fail: " + str(len(success_list) - sum(success_list)) + '. ' + success_emoji)
+
+class ResultsWriter:
+    """ Buffered JSON Lines file with one result per submitted record """
+
+    def __init__(self, name, object_name, operation):
+        os.makedirs('results', exist_ok=True)
+        self.path = 'results/results_' + name + '_' + new_run_id() + '.jsonl'
+        self.object_name = object_name
+        self.operation = operation
+        self.file = open(self.path, 'w', encoding='utf-8', buffering=1024 * 1024)
+
+    def write(self, records, result):
+        lines = []
+        for record, item in zip(records, result):
+            errors = [error if isinstance(error, dict) else {'message': str(error)} for error in item.get('errors') or []]
+            line = {
+                'id': item.get('id') or record.get('Id'),
+                'object': self.object_name,
+                'operation': self.operation,
+                'success': item['success'],
+                'errors': [error.get('statusCode') for error in errors],
+                'message': '; '.join(error.get('message') or '' for error in errors) or None
+            }
+            # Keep the payload of failures so they can be submitted again
+            if not item['success']:
+                line['record'] = record
+            lines.append(json.dumps(line, default=json_default))
+        if lines:
+            self.file.write('\n'.join(lines) + '\n')
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def write_results(name, object_name, operation, records, result):
+    """ Write the results of a bulk stage and return the path of the results file """
+    print('Exporting the results.')
+    with run_report.stage('write_results', file=name, records=len(result)), ResultsWriter(name, object_name, operation) as writer:
+        writer.write(records, result)
+    return writer.path
+
+def read_failed_records(results_path):
+    # Payloads of the records that failed, as written by ResultsWriter
+    with open(results_path, encoding='utf-8') as f:
+        return [line['record'] for line in map(json.loads, f) if not line['success']]
+
+def submit_bulk_stage(sf, journal, key, object_name, operation, records, options):
+    """ Submit a bulk stage unless it's done, returning the submitted records and their results """
+    step = journal.step(key)
+    if step.get('status') == 'done':
+        if not step.get('failed_count'):
+            print('Already done in a previous run. Skipping.')
+            return None
+        records = read_failed_records(step['results'])
+        print(f"Retrying the {len(records)} record(s) that failed in a previous run.")
+
+    return records, submit_bulk(sf, object_name, operation, records, options)
+
+def record_bulk_stage(journal, key, object_name, operation, records, result, name):
+    """ Report and write the results of a bulk stage and checkpoint it """
+    print_result_summary(result)
+    results_path = write_results(name, object_name, operation, records, result)
+
+    # A resumed run only retries the failures listed in the results file
+    failed_count = sum(1 for item in result if not item['success'])
+    journal.update(key, status='done', results=results_path, failed_count=failed_count)
+
+def push_bulk_stage(sf, journal, key, object_name, operation, records, name, options):
+    """ Submit a bulk stage and checkpoint it, skipping it on resume or retrying only its failed records """
+    submitted = submit_bulk_stage(sf, journal, key, object_name, operation, records, options)
+    if submitted is None:
+        return []
+
+    records, result = submitted
+    record_bulk_stage(journal, key, object_name, operation, records, result, name)
+    cache_pushed_flags(options, object_name, operation, records, result)
+    return result
+
+def cache_pushed_flags(options, object_name, operation, records, result):
+    """ Record the flag updates that succeeded in the contact cache """
+    if options.contact_cache is None or operation != 'update' or not records:
+        return
+    # The payloads of a stage all set the same fields
+    values = {field: value for field, value in records[0].items() if field != 'Id'}
+    updated_ids = [record['Id'] for record, item in zip(records, result) if item['success']]
+    options.contact_cache.update_flags(object_name, updated_ids, values)
+
+def extract_contact_columns(records):
+    """ Flatten contact query records into column arrays """
+    columns = {'Id': [], 'Email': [], 'GDPR__c': [], 'Unsubscribed': [], 'AccountId': [], 'RecordTypeId': [], 'GDPR_Account__c': []}
+    for record in records:
+        account = record.get('Account') or {}
+        columns['Id'].append(record['Id'])
+        columns['Email'].append(record.get('Email'))
+        columns['AccountId'].append(record.get('AccountId'))
+        columns['RecordTypeId'].append(account.get('RecordTypeId'))
+        columns['GDPR__c'].append(record.get('GDPR__c') is True)
+        columns['Unsubscribed'].append(record.get('HasOptedOutOfEmail') is True and record.get('Marketing_Status__c') == 'No Marketing')
+        columns['GDPR_Account__c'].append(account.get('GDPR_Account__c') is True)
+    return columns
+
+def iter_payloads(ids, **fields):
+    # One bulk payload per Id, with the same field values
+    for record_id in ids:
+        yield dict(Id=record_id, **fields)
+
+def export_csv(name, payloads):
+    """ Export bulk payloads to CSV and return them as a list """
+    # The journal checkpoints the payloads and bulk retries pick records from them, so they are kept in memory
+    payloads = list(payloads)
+    if payloads:
+        print('Exporting to CSV.')
+        os.makedirs('exports', exist_ok=True)
+        with run_report.stage('export_csv', file=name, records=len(payloads)), \
+                open(r'exports/' + name + '_' + new_run_id() + '.csv', 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=list(payloads[0]))
+            writer.writeheader()
+            writer.writerows(payloads)
+    return payloads
+
+def build_gdpr_payloads(records, household_record_type_id, contacts_name, accounts_name=None):
+    """ Build the contact and household account GDPR flag updates for queried contacts """
+    import numpy as np
+
+    columns = extract_contact_columns(records)
+    print(f"{len(columns['Id'])} contact(s) found.")
+
+    # Set flags
+    # For contacts, only if not flagged yet
+    is_flagged_contact = np.asarray(columns['GDPR__c'], dtype=bool)
+    contact_ids = np.asarray(columns['Id'], dtype=object)[~is_flagged_contact].tolist()
+    print(f"Identified {len(contact_ids)} contact(s) to be flagged for deletion. (Setting `GDPR__c` to true.)")
+    print(f"Skipping {int(is_flagged_contact.sum())} contact(s) that are already flagged.")
+    
+    # For accounts, once per household and only if not flagged yet
+    is_household = np.asarray(columns['RecordTypeId'], dtype=object) == household_record_type_id
+    is_flagged = np.asarray(columns['GDPR_Account__c'], dtype=bool)
+    household_account_ids = list(dict.fromkeys(np.asarray(columns['AccountId'], dtype=object)[is_household & ~is_flagged].tolist()))
+    already_flagged_count = len(set(np.asarray(columns['AccountId'], dtype=object)[is_household & is_flagged].tolist()))
+    print(f"Identified {len(household_account_ids)} household account(s) to be flagged for deletion, {already_flagged_count} already flagged. (Setting `GDPR_Account__c` to true.)")
+
+    # Export
+    target_data_contacts = export_csv(contacts_name, iter_payloads(contact_ids, GDPR__c=1))
+    target_data_accounts = list(iter_payloads(household_account_ids, GDPR_Account__c=1))
+    if accounts_name is not None:
+        target_data_accounts = export_csv(accounts_name, target_data_accounts)
+    return target_data_contacts, target_data_accounts
+
+# 13 to 19 digits, optionally grouped with spaces or dashes
+CARD_NUMBER_PATTERN = re.compile(r'(?<![\d-])\d(?:[ -]?\d){12,18}(?![\d-])')
+
+# Text fields that may hold card numbers, with the path to the contact of each record
+CARD_SCAN_SOURCES = [
+    ('Contact', 'Id', ['Description'], "SELECT Id, Description FROM Contact WHERE Id IN ({0})"),
+    ('Case', 'ContactId', ['Subject', 'Description'], "SELECT Id, ContactId, Subject, Description FROM Case WHERE ContactId IN ({0})"),
+    ('CaseComment', 'Parent.ContactId', ['CommentBody'], "SELECT Id, Parent.ContactId, CommentBody FROM CaseComment WHERE Parent.ContactId IN ({0})"),
+    ('EmailMessage', 'Parent.ContactId', ['Subject', 'TextBody'], "SELECT Id, Parent.ContactId, Subject, TextBody FROM EmailMessage WHERE Parent.ContactId IN ({0})")
+]
+
+# Texts sent to a scan worker at a time
+CARD_SCAN_BATCH_SIZE = 2000
+
+def luhn_valid(digits):
+    total = 0
+    for i, digit in enumerate(reversed(digits)):
+        value = ord(digit) - 48
+        if i % 2:
+            value *= 2
+            if value > 9:
+                value -= 9
+        total += value
+    return total % 10 == 0
+
+def scan_texts(texts):
+    """ Find card numbers in (object, record Id, contact Id, field, text) tuples, returning the hits with masked numbers """
+    hits = []
+    for object_name, record_id, contact_id, field, text in texts:
+        for match in CARD_NUMBER_PATTERN.finditer(text):
+            digits = re.sub(r'\D', '', match.group())
+            if luhn_valid(digits):
+                # Never write full card numbers to disk
+                hits.append({'object': object_name, 'record_id': record_id, 'contact_id': contact_id, 'field': field, 'masked_number': digits[:6] + '*' * (len(digits) - 10) + digits[-4:]})
+    return hits
+
+def get_path(record, path):
+    for key in path.split('.'):
+        record = (record or {}).get(key)
+    return record
+
+def iter_scan_texts(sf, contact_ids, options, failed_sources):
+    """ Stream the text fields of the contacts and their cases, case comments and emails, adding the objects that couldn't be read to failed_sources """
+    for object_name, contact_path, fields, query_template in CARD_SCAN_SOURCES:
+        count = 0
+        try:
+            for query in plan_in_clause_queries(query_template, contact_ids):
+                for record in iter_query(sf, query, options):
+                    count += 1
+                    for field in fields:
+                        # Only texts with enough digits can hold a card number
+                        text = record.get(field)
+                        if text and sum(character.isdigit() for character in text) >= 13:
+                            yield object_name, record['Id'], get_path(record, contact_path), field, text
+        except Exception as e:
+            # An object the user can't read shouldn't stop the scan of the others
+            print(f"Could not scan {object_name} records: {e}")
+            run_report.count('card_scan_errors')
+            failed_sources.append(object_name)
+        print(f"{count} {object_name} record(s) scanned.")
+
+def scan_for_card_numbers(sf, contact_ids, options):
+    """ Scan the text fields related to contacts for card numbers, in parallel processes; return the hits and the objects that couldn't be scanned """
+    hits = []
+    failed_sources = []
+    with run_report.stage('card_scan', contacts=len(contact_ids)) as details:
+        batches = iter_batches(iter_scan_texts(sf, contact_ids, options, failed_sources), CARD_SCAN_BATCH_SIZE)
+        if options.scan_workers == 1:
+            for batch in batches:
+                hits += scan_texts(batch)
+        else:
+            # Scan the pages already fetched while the next ones are queried
+            # Only a few batches wait per worker, so memory doesn't grow with the total text size
+            in_flight = collections.deque()
+            with ProcessPoolExecutor(max_workers=options.scan_workers) as executor:
+                for batch in batches:
+                    if len(in_flight) >= options.scan_workers * 2:
+                        hits += in_flight.popleft().result()
+                    in_flight.append(executor.submit(scan_texts, batch))
+                while in_flight:
+                    hits += in_flight.popleft().result()
+        details['hits'] = len(hits)
+    return hits, failed_sources
+
+async def run_email_list_pipeline(sf, journal, chunk_keys, queries, options):
+    """ Query, flag, update and write results for email list chunks as overlapping stages """
+    import asyncio
+
+    # Household accounts are flagged once for the whole run afterwards
+    # Bounded queues make faster stages wait for slower ones
+    transform_queue = asyncio.Queue(maxsize=options.concurrency)
+    update_queue = asyncio.Queue(maxsize=options.concurrency)
+    results_queue = asyncio.Queue(maxsize=options.concurrency)
+    # Split --concurrency: one call for the query stage, the rest for the parallel batches of the update stage
+    bulk_options = argparse.Namespace(**vars(options))
+    bulk_options.concurrency = max(1, options.concurrency - 1)
+    query_slots = asyncio.Semaphore(1)
+    # With a single slot, the two stages take turns
+    update_slots = query_slots if options.concurrency == 1 else asyncio.Semaphore(1)
+    total_chunks = len(chunk_keys)
+
+    async def query_stage():
+        for chunk_index, key in enumerate(chunk_keys, start=1):
+            print(f'Starting chunk {chunk_index} of {total_chunks}.')
+            step = journal.step(key)
+            if 'contacts' in step:
+                # Checkpointed by a previous run
+                records = None
+            elif key == 'cached':
+                records = step['records']
+            else:
+                async with query_slots:
+                    data = await asyncio.to_thread(timed_query, sf, queries[int(key.split('-')[1]) - 1], options)
+                records = data['records']
+                if options.contact_cache is not None:
+                    options.contact_cache.put(records)
+            await transform_queue.put((key, records))
+        await transform_queue.put(None)
+
+    async def transform_stage():
+        while (item := await transform_queue.get()) is not None:
+            key, records = item
+            if records is None:
+                target_data_contacts = journal.step(key)['contacts']
+            else:
+                target_data_contacts, target_data_accounts = build_gdpr_payloads(records, options.org['household_record_type_id'], file_prefix(options) + 'flag_contacts_from_bulk_list')
+                journal.update(key, contacts=target_data_contacts, accounts=target_data_accounts)
+            await update_queue.put((key, target_data_contacts))
+        await update_queue.put(None)
+
+    async def update_stage():
+        while (item := await update_queue.get()) is not None:
+            key, target_data_contacts = item
+            if len(target_data_contacts) == 0:
+                continue
+            try:
+                async with update_slots:
+                    submitted = await asyncio.to_thread(submit_bulk_stage, sf, journal, key + ':contacts', 'Contact', 'update', target_data_contacts, bulk_options)
+            except Exception as e:
+                journal.record_error(key + ':contacts', e)
+                continue
+            if submitted is not None:
+                await results_queue.put((key + ':contacts', file_prefix(options) + 'flag_contacts_from_bulk_list') + submitted)
+        await results_queue.put(None)
+
+    async def results_stage():
+        while (item := await results_queue.get()) is not None:
+            stage_key, name, records, result = item
+            record_bulk_stage(journal, stage_key, 'Contact', 'update', records, result, name)
+            cache_pushed_flags(options, 'Contact', 'update', records, result)
+
+    await asyncio.gather(query_stage(), transform_stage(), update_stage(), results_stage())
+
+def build_deletion_plan(options, dry_run=False):
+    """ Group the objects to delete into levels, children before parents """
+    prefix = file_prefix(options)
+    # Cases and any other configured children of flagged contacts
+    children = [('Case', "SELECT Id FROM Case WHERE Contact.GDPR__c = true", prefix + 'gdpr_contact_cases_to_delete', 'cases')]
+    for child in options.delete_child:
+        object_name, relationship = child.split('.', 1)
+        children.append((object_name, f"SELECT Id FROM {object_name} WHERE {relationship}.GDPR__c = true", prefix + f'gdpr_contact_{object_name.lower()}_to_delete', object_name + ' records'))
+
+    # Only households without any contacts left, so no other household members are deleted with them
+    remaining_contacts = "SELECT AccountId FROM Contact WHERE AccountId != null"
+    if dry_run:
+        # The flagged contacts are not deleted yet, so leave them out
+        remaining_contacts += " AND GDPR__c = false"
+
+    return [
+        children,
+        [('Contact', "SELECT Id FROM Contact WHERE GDPR__c = true", prefix + 'gdpr_contacts_to_delete', 'contacts')],
+        [('Account', f"SELECT Id FROM Account WHERE GDPR_Account__c = true AND Id NOT IN ({remaining_contacts})", prefix + 'gdpr_accounts_to_delete', 'household accounts')]
+    ]
+
+def deletion_operation(options):
+    return 'hard_delete' if options.hard_delete else 'delete'
+
+def count_records(sf, query, options):
+    """ Count the records of a SELECT Id query with SELECT COUNT() """
+    count_query = re.sub(r'^SELECT Id FROM', 'SELECT COUNT() FROM', query)
+    with run_report.stage('soql_count') as details:
+        details['records'] = call_with_retries(lambda: sf.query(count_query), options, 'Count query')['totalSize']
+    run_report.count('soql_queries')
+    return details['records']
+
+def plan_deletion_batch_size(count, options):
+    """ Pick the batch size of a deletion from its record count """
+    if not options.hard_delete or options.serial or options.adaptive_batch_size:
+        return options.batch_size
+    # Spread the records over every batch in flight, so large purges need fewer jobs and API calls
+    return min(MAX_BATCH_SIZE, max(options.batch_size, ceil(count / options.concurrency)))
+
+def estimate_deletion(count, options):
+    """ Estimate the batches and API calls of a deletion, not counting retries """
+    if count == 0:
+        # Only the count query
+        return {'batch_size': options.batch_size, 'batches': 0, 'api_calls': 1}
+    if options.backend == 'bulk2':
+        # A query job (create, poll, one request per page of Ids), then one ingest job per page (create, upload, close, poll, failed records)
+        pages = ceil(count / BULK2_QUERY_PAGE_SIZE)
+        return {'batch_size': BULK2_QUERY_PAGE_SIZE, 'batches': pages, 'api_calls': 1 + 2 + pages + 5 * pages}
+    # Query pages of Ids, then one job per batch (create job, add batch, close job, poll, results)
+    batch_size = plan_deletion_batch_size(count, options)
+    batches = ceil(count / batch_size)
+    return {'batch_size': batch_size, 'batches': batches, 'api_calls': 1 + ceil(count / QUERY_PAGE_SIZE) + 5 * batches}
+
+def delete_flagged_object(sf, object_name, query, name, label, options):
+    """ Delete the records of one object returned by a query """
+    with run_report.stage('delete_flagged', object=object_name, operation=deletion_operation(options)) as details:
+        # Size the job first, and skip the Id query when there is nothing to delete
+        details['records'] = count_records(sf, query, options)
+        if details['records'] == 0:
+            print(f"0 {label} found.")
+            return
+        sized_options = argparse.Namespace(**vars(options))
+        sized_options.batch_size = plan_deletion_batch_size(details['records'], options)
+        delete_flagged_object_records(sf, object_name, query, name, label, sized_options)
+
+def delete_flagged_object_records(sf, object_name, query, name, label, options):
+    if options.backend == 'bulk2':
+        # Stream Ids to disk and delete them with Bulk API 2.0 ingest jobs
+        files = bulk2_delete_from_query(sf, object_name, query, name, deletion_operation(options))
+        # Drop the deleted contacts from the cache
+        if object_name == 'Contact' and options.contact_cache is not None:
+            options.contact_cache.invalidate_contacts(iter_ids_from_files(files))
+        return
+
+    os.makedirs('exports', exist_ok=True)
+
+    # Delete each chunk as soon as its query pages arrive instead of waiting for the full result set
+    batch_size = get_batch_size(options, object_name, deletion_operation(options))
+    chunk = []
+    result = []
+    with open('exports/' + name + '_' + new_run_id() + '.csv', 'w', newline='', encoding='utf-8') as export_file, \
+            ResultsWriter(name, object_name, deletion_operation(options)) as results_writer:
+        writer = csv.writer(export_file)
+        writer.writerow(['Id'])
+
+        def flush(chunk):
+            chunk_result = submit_bulk(sf, object_name, deletion_operation(options), chunk, options)
+            results_writer.write(chunk, chunk_result)
+            # Drop the deleted contacts from the cache
+            if object_name == 'Contact' and options.contact_cache is not None:
+                options.contact_cache.invalidate_contacts(item['id'] for item in chunk_result if item['success'])
+            # Only keep the outcome for the summary
+            result.extend({'success': item['success']} for item in chunk_result)
+
+        for record in iter_query(sf, query, options):
+            writer.writerow([record['Id']])
+            chunk.append({'Id': record['Id']})
+            # One batch per worker, following the adaptive batch size
+            if len(chunk) >= (batch_size() if callable(batch_size) else batch_size) * options.concurrency:
+                flush(chunk)
+                chunk = []
+        if chunk:
+            flush(chunk)
+
+    run_report.count('soql_queries')
+    run_report.count('records_queried', len(result))
+    print(f"{len(result)} {label} found.")
+    print_result_summary(result)
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description='Process SFDC data removal requests. Run without a command for the interactive menu.'
+    )
+    parser.add_argument('--config', help='Path to the SFDC credentials file (default: sfdc.ini next to the script).')
+    parser.add_argument('--batch-size', type=batch_size_type, default=2000, help=f'Records per Bulk API batch, up to {MAX_BATCH_SIZE} (default: 2000).')
+    parser.add_argument('--concurrency', type=positive_int_type, default=4, help='Maximum number of Bulk API batches in flight (default: 4).')
+    parser.add_argument('--serial', action='store_true', help='Submit Bulk API batches in serial mode only.')
+    parser.add_argument('--adaptive-batch-size', action='store_true', help='Grow the batch size while batches succeed and shrink it on lock and timeout errors, starting from --batch-size.')
+    parser.add_argument('--max-retries', type=int, default=3, help='Retries of failed batches and of records that failed with lock or timeout errors (default: 3).')
+    parser.add_argument('--retry-delay', type=float, default=2.0, help='Seconds before the first retry, doubled on each attempt (default: 2).')
+    parser.add_argument('--skip-card-scan', action='store_true', help='Only export the credit card removal requests, without scanning SFDC for card numbers.')
+    parser.add_argument('--scan-workers', type=positive_int_type, default=os.cpu_count(), help='Processes used to scan texts for card numbers (default: number of CPUs).')
+    parser.add_argument('--combined-query', action='store_true', help='Query the contacts for all request types in a single pass.')
+    parser.add_argument('--cache', action='store_true', help='Cache contact lookups in a local SQLite file.')
+    parser.add_argument('--cache-path', default='cache/contacts.sqlite', help='Path to the contact cache (default: cache/contacts.sqlite).')
+    parser.add_argument('--cache-ttl', type=positive_int_type, default=24, help='Hours before a cached contact is queried again (default: 24).')
+    parser.add_argument('--cache-max-entries', type=positive_int_type, default=500000, help='Maximum number of cached email addresses (default: 500000).')
+    parser.add_argument('--ledger', action='store_true', help='Skip the OneTrust requests that earlier runs processed successfully.')
+    parser.add_argument('--ledger-path', default='cache/requests.sqlite', help='Path to the ledger of processed requests (default: cache/requests.sqlite).')
+    parser.add_argument('--request-id-column', default='Request ID', help="Column of the OneTrust export with the request id, used as the ledger key (default: 'Request ID'). Email addresses are used if it's missing.")
+    parser.add_argument('--pipeline', action='store_true', help='Overlap querying, flagging and updating of email list chunks.')
+    parser.add_argument('--resume', metavar='JOB_ID', help='Resume an interrupted requests or emails job, skipping its completed chunks and stages.')
+    parser.add_argument('--hard-delete', action='store_true', help='Delete flagged records with Bulk API hard delete, skipping the recycle bin. Needs the "Bulk API Hard Delete" permission.')
+    parser.add_argument('--dry-run', action='store_true', help='Only count the records flagged for deletion and estimate the batches and API calls, without deleting anything.')
+    parser.add_argument('--delete-child', action='append', default=[], type=child_object_type, metavar='OBJECT.RELATIONSHIP', help='Also delete the records of a child object of flagged contacts before the contacts, e.g. Survey__c.Contact__r. Can be repeated.')
+    parser.add_argument('--org', dest='org_names', action='append', metavar='NAME', help='Only run for this org of the config file. Can be repeated. All orgs run by default.')
+    parser.add_argument('--session-cache', metavar='PATH', help='Cache the SFDC session id in this file and reuse it in later runs until it expires.')
+    parser.add_argument('--session-ttl', type=positive_int_type, default=60, help='Minutes a cached session id is reused (default: 60).')
+    parser.add_argument('--prometheus-textfile', metavar='PATH', help='Also write the run metrics to a Prometheus textfile collector file.')
+    parser.add_argument('--backend', choices=['bulk1', 'bulk2'], default='bulk1', help='Bulk API version used for updates and deletions (default: bulk1).')
+    subparsers = parser.add_subparsers(dest='command')
+
+    # Handle a list of requests
+    parser_requests = subparsers.add_parser('requests', help='Handle a OneTrust export of requests.')
+    parser_requests.add_argument('file', nargs='?', help='Path to the OneTrust XLSX or CSV export. Not needed with --resume.')
+    parser_requests.add_argument('--format', choices=['xlsx', 'csv'], help='File format. Guessed from the file extension if omitted.')
+
+    # Handle a list of email addresses
+    parser_emails = subparsers.add_parser('emails', help='Flag the contacts in a TXT list of email addresses.')
+    parser_emails.add_argument('file', nargs='?', help='Path to the TXT file with one email address per line. Not needed with --resume.')
+
+    # Delete all flagged records
+    subparsers.add_parser('delete-flagged', help='Delete all records flagged for deletion.')
+
+    # Process new files dropped into an inbox folder
+    parser_watch = subparsers.add_parser('watch', help='Keep running and process the OneTrust exports and email lists dropped into an inbox folder.')
+    parser_watch.add_argument('inbox', nargs='?', default='inbox', help='Folder to watch for CSV or XLSX exports and TXT email lists (default: inbox).')
+    parser_watch.add_argument('--archive', default='archive', help='Folder where processed files are moved, one subfolder per batch (default: archive).')
+    parser_watch.add_argument('--failed', default='failed', help='Folder where files that failed to process are moved (default: failed).')
+    parser_watch.add_argument('--window', type=float, default=60.0, help='Seconds to collect new files into one batch after the first one arrives (default: 60).')
+    parser_watch.add_argument('--poll-interval', type=float, default=5.0, help='Seconds between checks of the inbox (default: 5).')
+    parser_watch.add_argument('--keepalive', type=positive_int_type, default=15, help='Minutes between API calls that keep the SFDC session alive while idle (default: 15).')
+    parser_watch.add_argument('--once', action='store_true', help='Process the files already in the inbox as one batch and exit.')
+
+    return parser
+
+def run_interactive(orgs, options):
+    while True:
+        # Get user selection
+        user_action = get_user_action()
+
+        if user_action == 'Handle a list of requests':
+            run_action(options, 'requests', handle_requests, orgs, options)
+        elif user_action == 'Handle a list of email addresses':
+            run_action(options, 'emails', handle_email_list, orgs, options)
+        elif user_action == 'Delete all flagged records':
+            run_action(options, 'delete_flagged', delete_flagged_records, orgs, options)
+        elif user_action == 'Exit':
+            print("Exiting...")
+            break
+
+def run_headless(orgs, options):
+    if options.command in ('requests', 'emails') and not options.file and not options.resume:
+        raise ValueError(f"The {options.command} command needs a file unless --resume is used.")
+
+    if options.command == 'requests':
+        file_type = options.format
+        if file_type is None and options.file:
+            file_type = guess_file_type(options.file)
+        return run_action(options, 'requests', handle_requests, orgs, options, file_path=options.file, file_type=file_type)
+    elif options.command == 'emails':
+        return run_action(options, 'emails', handle_email_list, orgs, options, file_path=options.file)
+    elif options.command == 'delete-flagged':
+        return run_action(options, 'delete_flagged', delete_flagged_records, orgs, options)
+    elif options.command == 'watch':
+        return watch_inbox(orgs, options)
+
+def main(argv=None):
+    options = build_parser().parse_args(argv)
+    options.interactive = options.command is None
+    run_report.startup_seconds = round(time.perf_counter() - IMPORT_STARTED, 4)
+
+    # Resolve input paths before changing the working directory
+    options.config = os.path.abspath(options.config) if options.config else 'sfdc.ini'
+    if getattr(options, 'file', None):
+        options.file = os.path.abspath(options.file)
+    if options.command == 'watch':
+        options.inbox = os.path.abspath(options.inbox)
+        options.archive = os.path.abspath(options.archive)
+        options.failed = os.path.abspath(options.failed)
+
     try:
         # Welcome message
         print('Welcome to the contact removal tool.')
         print('Getting things ready...')
-        
-        # Set working directory
-        def get_script_dir():
-            """ Get the directory of the current script or executable """
-            if getattr(sys, 'frozen', False):
-                # If the application is run as a bundle, the pyInstaller bootloader
-                # sets the sys.frozen attribute and this method returns the path
-                # to the bundle file.
-                return os.path.dirname(sys.executable)
-            else:
-                # If the application is run in a normal Python environment, return
-                # the path to the script file.
-                return os.path.dirname(os.path.abspath(__file__))
 
+        # Set working directory
         script_dir = get_script_dir()
         os.chdir(script_dir)
 
-        # Get SFDC credentials
-        print('Opening sfdc.ini to get the SFDC credentials.')
-        # Initialize the ConfigParser
-        config = ConfigParser()
-
-        # Define the path to the config file
-        config_file_path = 'sfdc.ini'
+        # Get the SFDC credentials of each org
+        print(f'Opening {options.config} to get the SFDC credentials.')
+        orgs, options.routing_column = load_org_profiles(options.config)
 
-        # Check if the config file exists
-        if not os.path.exists(config_file_path):
-            raise FileNotFoundError(f"{config_file_path} does not exist.")
+        # Open the sessions and contact caches, one per org
+        open_org_resources(orgs, options)
 
-        # Read the config.ini file
-        config.read(config_file_path)
+        # Open the ledger of processed requests
+        options.request_ledger = RequestLedger(options.ledger_path) if options.ledger else None
 
-        # Retrieve the secrets
-        SFDC_USERNAME = config.get('secrets', 'SFDC_USERNAME')
-        SFDC_PASSWORD = config.get('secrets', 'SFDC_PASSWORD')
-        SFDC_TOKEN = config.get('secrets', 'SFDC_TOKEN')
-
-        # Raise an error if any of the secrets are missing
-        if not SFDC_USERNAME or not SFDC_PASSWORD or not SFDC_TOKEN:
-            raise ValueError("One or more SFDC credentials are not set in config file.")
-        
-        while True:
-            # Get user selection
-            user_action = get_user_action()
-            
-            if user_action == 'Handle a list of requests':
-                handle_requests()
-            elif user_action == 'Handle a list of email addresses':
-                handle_email_list()
-            elif user_action == 'Delete all flagged records':
-                delete_flagged_records()
-            elif user_action == 'Exit':
-                print("Exiting...")
-                break
+        if options.interactive:
+            run_interactive(orgs, options)
+        else:
+            run_headless(orgs, options)
 
     except Exception as e:
         print("An error occurred:")
         print(traceback.format_exc())
-        input("Press Enter to exit...")
+        if options.interactive:
+            input("Press Enter to exit...")
+        else:
+            return 1
+
+    return 0
+
+# Columns of the OneTrust export that are needed to route requests
+REQUEST_COLUMNS = ['Task Assignee - Subtask', 'Workflows', 'Email']
+
+WORKFLOW_REQUEST_TYPES = {
+    '[Consumer] Data Removal': 'data_removal',
+    '[E&E] Data Removal': 'data_removal',
+    '[Consumer] Unsubscribe': 'unsubscribe',
+    '[Consumer] Credit Card Removal': 'credit_card_removal'
+}
+
+def guess_file_type(file_path):
+    return 'xlsx' if file_path.lower().endswith(('.xlsx', '.xls')) else 'csv'
 
-def handle_requests():
+def iter_export_values(file_path, file_type):
+    """ Yield the header of a OneTrust export, then the raw values of each row, one at a time """
+    if file_path.lower().endswith('.xls'):
+        raise ValueError("Legacy .xls files can't be read. Save the export as XLSX or CSV.")
+    if file_type == 'xlsx':
+        from openpyxl import load_workbook
+
+        # Read-only mode streams the sheet instead of loading it
+        workbook = load_workbook(file_path, read_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            yield [cell_text(value) for value in next(rows, [])]
+            yield from rows
+        finally:
+            workbook.close()
+    else:
+        with open(file_path, newline='', encoding='utf-8-sig') as f:
+            yield from csv.reader(f)
+
+def cell_text(value):
+    return '' if value is None else str(value)
+
+def project_row(column_indexes, values):
+    """ Build a row dict of strings from the values at the given column indexes """
+    return {column: cell_text(values[i]) if i < len(values) else '' for column, i in column_indexes.items()}
+
+def iter_export_rows(file_path, file_type):
+    """ Yield the rows of a OneTrust export as dicts of strings, one at a time """
+    with contextlib.closing(iter_export_values(file_path, file_type)) as rows:
+        header = next(rows, [])
+        column_indexes = {column: i for i, column in enumerate(header)}
+        for values in rows:
+            yield project_row(column_indexes, values)
+
+def iter_requests(file_path, file_type, counts, extra_columns=()):
+    """ Yield the request type and row of each Salesforce request in a OneTrust export.
+    Rows only hold REQUEST_COLUMNS and the extra columns, except for credit card removals, whose export needs the full row """
+    with contextlib.closing(iter_export_values(file_path, file_type)) as rows:
+        header = next(rows, [])
+        missing_columns = [column for column in REQUEST_COLUMNS if column not in header]
+        if missing_columns:
+            raise ValueError(f"Missing column(s): {', '.join(missing_columns)}")
+        all_indexes = {column: i for i, column in enumerate(header)}
+        column_indexes = {column: all_indexes[column] for column in REQUEST_COLUMNS + [column for column in extra_columns if column in all_indexes]}
+        assignee_index, workflow_index = all_indexes['Task Assignee - Subtask'], all_indexes['Workflows']
+
+        for values in rows:
+            counts['loaded'] += 1
+
+            # Filter for Salesforce tasks, without converting the other cells
+            if assignee_index >= len(values) or cell_text(values[assignee_index]) != 'Salesforce':
+                continue
+            counts['salesforce'] += 1
+
+            # Categorize
+            request_type = WORKFLOW_REQUEST_TYPES.get(cell_text(values[workflow_index]) if workflow_index < len(values) else '')
+            if request_type is None:
+                continue
+            row = project_row(all_indexes if request_type == 'credit_card_removal' else column_indexes, values)
+            if row['Email']:
+                yield request_type, row
+
+def request_key(row, options):
+    # The OneTrust request id, or the email address for exports without one
+    return (row.get(options.request_id_column) or '').strip() or normalize_email(row['Email'])
+
+def skip_processed_requests(ledger, routed_requests):
+    """ Drop the requests that earlier runs processed successfully, returning how many were dropped """
+    skipped = 0
+    for org_name, routed in routed_requests.items():
+        for request_type, keys in routed['keys'].items():
+            processed = ledger.processed(org_name, request_type, keys)
+            if not processed:
+                continue
+            pending = [i for i, key in enumerate(keys) if key not in processed]
+            skipped += len(keys) - len(pending)
+            routed['keys'][request_type] = [keys[i] for i in pending]
+            routed['email_lists'][request_type] = [routed['email_lists'][request_type][i] for i in pending]
+            if request_type == 'credit_card_removal':
+                routed['cc_rows'] = [routed['cc_rows'][i] for i in pending]
+    return skipped
+
+def stages_succeeded(journal, *keys):
+    # Stages that never ran had nothing to push
+    return all(journal.step(key).get('status') != 'error' and not journal.step(key).get('failed_count') for key in keys)
+
+def record_processed_requests(ledger, org_name, routed, journal):
+    """ Record which request types of an org were fully processed, so the next run skips them """
+    succeeded = {
+        'data_removal': stages_succeeded(journal, 'data_removal:contacts', 'data_removal:accounts'),
+        'unsubscribe': stages_succeeded(journal, 'unsubscribe:contacts'),
+        # Only once every related object was scanned
+        'credit_card_removal': journal.step('credit_card_removal:export').get('scanned', False)
+    }
+    for request_type, keys in routed['keys'].items():
+        ledger.record(org_name, request_type, keys, 'done' if succeeded[request_type] else 'failed')
+
+def handle_requests(orgs, options, file_path=None, file_type=None):
     print("Handling list of requests...")
 
+    # Resume a previous job with the same input file and org
+    journal = resume_journal(options, 'requests')
+    if journal is not None:
+        file_path = journal.data['input']['file_path']
+        file_type = journal.data['input']['file_type']
+        selected_orgs = select_orgs(orgs, options, [journal.data['input']['org']])
+    else:
+        selected_orgs = select_orgs(orgs, options)
+
     # Load requests
-    root = tk.Tk()
-    root.withdraw()
-    res_2 = input('XLSX (x) or CSV (c)? ')
-    root = tk.Tk()
-    root.withdraw()
-    file_path = filedialog.askopenfilename()
+    if file_path is None:
+        res_2 = input('XLSX (x) or CSV (c)? ')
+        file_type = {'x': 'xlsx', 'c': 'csv'}.get(res_2)
+        if file_type is None:
+            print("Invalid input. Returning to the main menu...")
+            return
+        file_path = ask_for_file()
 
     # Handle case where no file is selected
     if not file_path:
         print("No file selected. Returning to the main menu...")
         return  # Return to the main menu
     
+    # Stream the export, keep only the Salesforce requests and route each one to its org
+    counts = {'loaded': 0, 'salesforce': 0, 'unrouted': 0}
+    unrouted_rows = []
+    routed_requests = {org['name']: {
+        'email_lists': {'data_removal': [], 'unsubscribe': [], 'credit_card_removal': []},
+        'keys': {'data_removal': [], 'unsubscribe': [], 'credit_card_removal': []},
+        'cc_rows': []
+    } for org in selected_orgs}
     try:
-        if res_2 == 'x':
-            df_requests = pd.read_excel(file_path, dtype=str)
-        if res_2 == 'c':
-            df_requests = pd.read_csv(file_path, dtype=str)
-        else:
-            print("Invalid input. Returning to the main menu...")
-            return
+        # Loading, filtering and routing happen in one pass
+        with run_report.stage('load_and_filter_requests') as details:
+            extra_columns = [column for column in (options.routing_column, options.request_id_column) if column]
+            for request_type, row in iter_requests(file_path, file_type, counts, extra_columns):
+                org_name = route_request(row, orgs, options.routing_column)
+                if org_name is None:
+                    counts['unrouted'] += 1
+                    unrouted_rows.append(row)
+                    continue
+                if org_name not in routed_requests:
+                    # The org isn't part of this run
+                    continue
+                routed_requests[org_name]['email_lists'][request_type].append(row['Email'])
+                routed_requests[org_name]['keys'][request_type].append(request_key(row, options))
+                # Keep the full row for the credit card removal export
+                if request_type == 'credit_card_removal':
+                    routed_requests[org_name]['cc_rows'].append(dict(row, request_type=request_type))
+            details.update(counts)
     except Exception as e:
+        if not options.interactive:
+            # Let scheduled runs fail with a non-zero exit code
+            raise ValueError(f"Error loading the file: {e}") from e
         print(f"Error loading the file: {e}. Returning to the main menu...")
         return  # Return to the main menu if file reading fails
         
-    print(f"{df_requests.shape[0]} requests loaded.")
-    
+    print(f"{counts['loaded']} requests loaded.")
+
     # Filter for Salesforce tasks
     print('Filtering for Salesforce tasks.')
-    df_requests = df_requests.loc[df_requests['Task Assignee - Subtask'] == 'Salesforce'].reset_index(drop=True)
-    print(f"{df_requests.shape[0]} requests remaining.")
+    print(f"{counts['salesforce']} requests remaining.")
+    if counts['unrouted']:
+        print(f"Skipping {counts['unrouted']} request(s) that don't match the ROUTES of any org.")
+        # Keep them for a manual review
+        export_csv('unrouted_requests', unrouted_rows)
 
-    
-    # Mapping based on conditions
-    print('Categorizing.')
-    conditions = [
-        df_requests['Workflows'].isin(['[Consumer] Data Removal', '[E&E] Data Removal']),
-        df_requests['Workflows'] == '[Consumer] Unsubscribe',
-        df_requests['Workflows'] == '[Consumer] Credit Card Removal'
-    ]
+    # Only process new requests and those that failed before
+    if options.request_ledger is not None:
+        skipped = skip_processed_requests(options.request_ledger, routed_requests)
+        print(f"Skipping {skipped} request(s) already processed in earlier runs.")
 
-    choices = ['data_removal', 'unsubscribe', 'credit_card_removal']
-        
-    df_requests['request_type'] = np.select(conditions, choices, default=np.nan)
+    job_input = {'file_path': file_path, 'file_type': file_type}
+    run_for_orgs(selected_orgs, options, process_org_requests, routed_requests, job_input, journal)
+
+    pause("Task completed. 🚀 Press Enter to return to the main menu...", options)
+
+def process_org_requests(org, options, routed_requests, job_input, journal):
+    """ Flag, unsubscribe and export the requests routed to one org """
+    import numpy as np
+
+    email_lists = routed_requests[org['name']]['email_lists']
+    cc_rows = routed_requests[org['name']]['cc_rows']
+    prefix = file_prefix(options)
+    if len(routed_requests) > 1:
+        print(f"Processing {sum(len(email_list) for email_list in email_lists.values())} request(s) routed to {org['name']}.")
+
+    # Start a new job
+    if journal is None:
+        journal = JobJournal.create('requests', dict(job_input, org=org['name']))
 
     # Get lists of email addresses
-    print('Extracting email addresses.')
+    print('Categorizing and extracting email addresses.')
     
-    data_removal_email_list = df_requests.loc[df_requests['request_type'] == 'data_removal']['Email'].tolist()
+    data_removal_email_list = email_lists['data_removal']
     print(f"Identified {len(data_removal_email_list)} data removal requests.")
+    data_removal_email_list, report = build_email_index(data_removal_email_list)
+    print_email_report(report, prefix + 'data_removal')
 
-    unsubscribe_email_list = df_requests.loc[df_requests['request_type'] == 'unsubscribe']['Email'].tolist()
+    unsubscribe_email_list = email_lists['unsubscribe']
     print(f"Identified {len(unsubscribe_email_list)} unsubscribe requests.")
+    unsubscribe_email_list, report = build_email_index(unsubscribe_email_list)
+    print_email_report(report, prefix + 'unsubscribe')
 
-    cc_removal_email_list = df_requests.loc[df_requests['request_type'] == 'credit_card_removal']['Email'].tolist()
+    cc_removal_email_list = email_lists['credit_card_removal']
     print(f"Identified {len(cc_removal_email_list)} credit card removal requests.")
-
-    # To strings for queries
-    data_removal_email_list_str = ','.join(f"'{x}'" for x in data_removal_email_list)
-    unsubscribe_email_list_str = ','.join(f"'{x}'" for x in unsubscribe_email_list)
-    cc_removal_email_list_str = ','.join(f"'{x}'" for x in cc_removal_email_list)
+    cc_removal_email_list, report = build_email_index(cc_removal_email_list)
+    print_email_report(report, prefix + 'cc_removal')
 
     # Pause
-    input("Next step: Connect to SFDC. Press Enter to continue...")
+    pause("Next step: Connect to SFDC. Press Enter to continue...", options)
 
     # Initiate SFDC connection
-    sf = Salesforce(
-        username=SFDC_USERNAME,
-        password=SFDC_PASSWORD,
-        security_token=SFDC_TOKEN
-    )
+    sf = connect_to_sfdc(options)
+
+    # Contacts saved by a previous run don't need to be queried again
+    data_removal_step = journal.step('data_removal')
+    unsubscribe_step = journal.step('unsubscribe')
+    cc_removal_step = journal.step('credit_card_removal:export')
+
+    if options.combined_query and not ('contacts' in data_removal_step and 'contacts' in unsubscribe_step and cc_removal_step.get('status') == 'done'):
+        # Query the contacts for all request types in one pass
+        print('Querying contacts for all requests from SFDC.')
+        records_by_type = query_contacts_by_request_type(sf, {
+            'data_removal': data_removal_email_list,
+            'unsubscribe': unsubscribe_email_list,
+            'credit_card_removal': cc_removal_email_list
+        }, options)
     
     # Query data removal contacts and accounts
     # Careful: data mix
     
-    print('Querying accounts and contacts from SFDC.')
-    query = """
-    SELECT
-        Id,
-        AccountId,
-        Account.RecordTypeId
-    FROM Contact WHERE Email IN (
-        {0}
-    )
-    """
-
-    # Remove first and last line
-    query = "\n".join(query.split("\n")[1:-1])
-    # Add variables
-    query = query.format(data_removal_email_list_str)
-    # Run query
-    data = sf.query_all(query)
-
-    # Get rows
-    rows = []
-    for item in data['records']:
-        row = {}
-        try:
-            row['Id'] = item['Id']
-            row['AccountId'] = item['AccountId']
-        except:
-            pass
-        try:
-            row['RecordTypeId'] = item['Account']['RecordTypeId']
-        except:
-            pass
-        rows.append(row)
-
-    # To dataframe
-    df = pd.DataFrame(rows)
-    print(f"{df.shape[0]} contact(s) found.")
-
-    # Set flags
-    # For contacts
-    df['GDPR__c'] = 1
-    
-    print(f"Identified {df.shape[0]} contact(s) to be flagged for deletion. (Setting `GDPR__c` to true.)")
-    
-    # For accounts
-    df['GDPR_Account__c'] = np.where(df['RecordTypeId'] == '012d0000000W68QAAS', 1, 0)
-    print(f"Identified {df['GDPR_Account__c'].sum()} household account(s) to be flagged for deletion. (Setting `GDPR_Account__c` to true.)")
-    
-    # Split
-    df_contacts = df[[
-        'Id',
-        'GDPR__c'
-    ]]
-
-    df_accounts = df[[
-        'AccountId',
-        'GDPR_Account__c'
-    ]]
-
-    # Rename
-    df_accounts = df_accounts.rename(columns={'AccountId': 'Id'}, inplace=False)
-    # Filter
-    df_accounts = df_accounts.loc[df_accounts['GDPR_Account__c'] == 1]
-
-    
-    # Export
-    print('Exporting to CSV.')
-    os.makedirs('exports', exist_ok=True)
-    df_contacts.to_csv(r'exports/data_removal_contacts_' + datetime.datetime.today().strftime('%Y-%m-%d-%H-%M-%S') + '.csv', encoding='utf-8', index=False)
-    df_accounts.to_csv(r'exports/data_removal_accounts_' + datetime.datetime.today().strftime('%Y-%m-%d-%H-%M-%S') + '.csv', encoding='utf-8', index=False)
+    if 'contacts' in data_removal_step:
+        print('Using the contacts and accounts queried in the previous run.')
+        target_data_contacts = data_removal_step['contacts']
+        target_data_accounts = data_removal_step['accounts']
+    else:
+        print('Querying accounts and contacts from SFDC.')
+        if options.combined_query:
+            # Already queried
+            records = records_by_type['data_removal']
+        else:
+            # Run query in chunks, skipping cached contacts
+            records = lookup_contacts(sf, data_removal_email_list, options)
 
-    # Convert to lists of dicts
-    target_data_contacts = df_contacts.to_dict('records')
-    target_data_accounts = df_accounts.to_dict('records')
+        target_data_contacts, target_data_accounts = build_gdpr_payloads(records, org['household_record_type_id'], prefix + 'data_removal_contacts', prefix + 'data_removal_accounts')
+        journal.update('data_removal', contacts=target_data_contacts, accounts=target_data_accounts)
 
     # Push contact updates to SFDC
     print('Pushing the GDPR flag update to contacts in SFDC. Please wait.')
-    result = sf.bulk.Contact.update(target_data_contacts,batch_size=20,use_serial=True)
-
-    # Print success count
-    success_list = [1 if d['success'] is True else 0 for d in result]
-    success_emoji = '✔️' if (len(success_list) - sum(success_list)) == 0 else '💥'
-    print("OK: " + str(sum(success_list)) + ", Fail: " + str(len(success_list) - sum(success_list)) + '. ' + success_emoji)
-
-    # Write results to file
-    print('Exporting the results.')
-    os.makedirs('results', exist_ok=True)
-    with open(r'results/results_data_removal_contacts_' + datetime.datetime.today().strftime('%Y-%m-%d-%H-%M-%S') + '.txt', 'w') as f:
-        for item in result:
-            f.write("%s\n" % item)
+    push_bulk_stage(sf, journal, 'data_removal:contacts', 'Contact', 'update', target_data_contacts, prefix + 'data_removal_contacts', options)
 
     # Push account updates to SFDC
     print('Pushing the GDPR flag update to household accounts in SFDC. Please wait.')
-    result = sf.bulk.Account.update(target_data_accounts,batch_size=20,use_serial=True)
-
-    # Print success count
-    success_list = [1 if d['success'] is True else 0 for d in result]
-    success_emoji = '✔️' if (len(success_list) - sum(success_list)) == 0 else '💥'
-    print("OK: " + str(sum(success_list)) + ", Fail: " + str(len(success_list) - sum(success_list)) + '. ' + success_emoji)
-
-    # Write results to file
-    print('Exporting the results.')
-    os.makedirs('results', exist_ok=True)
-    with open(r'results/results_data_removal_accounts_' + datetime.datetime.today().strftime('%Y-%m-%d-%H-%M-%S') + '.txt', 'w') as f:
-        for item in result:
-            f.write("%s\n" % item)
+    push_bulk_stage(sf, journal, 'data_removal:accounts', 'Account', 'update', target_data_accounts, prefix + 'data_removal_accounts', options)
     
     # Process unsubscribe contacts
     if len(unsubscribe_email_list) > 0:
 
-        # Query unsubscribe contacts
-        print('Querying contacts from SFDC that want to unsubscribe.')
-        query = """
-        SELECT
-            Id
-        FROM Contact WHERE Email IN (
-            {0}
-        )
-        """
-
-        # Remove first and last line
-        query = "\n".join(query.split("\n")[1:-1])
-        # Add variables
-        query = query.format(unsubscribe_email_list_str)
-        # Run query
-        data = sf.query_all(query)
-
-        
-        # To dataframe
-        df = pd.DataFrame(data['records']).drop(['attributes'],axis=1)
-        print(f"{df.shape[0]} contact(s) found.")
+        if 'contacts' in unsubscribe_step:
+            print('Using the unsubscribe contacts queried in the previous run.')
+            target_data = unsubscribe_step['contacts']
+        else:
+            # Query unsubscribe contacts
+            print('Querying contacts from SFDC that want to unsubscribe.')
+            if options.combined_query:
+                # Already queried
+                records = records_by_type['unsubscribe']
+            else:
+                # Run query in chunks, skipping cached contacts
+                records = lookup_contacts(sf, unsubscribe_email_list, options)
 
-        if df.shape[0] > 0:
             
+            columns = extract_contact_columns(records)
+            print(f"{len(columns['Id'])} contact(s) found.")
+
             # Set flags
             print("Preparing to set `HasOptedOutOfEmail` to true and `Marketing_Status__c` to 'No Marketing'.")
-            df['HasOptedOutOfEmail'] = 1
-            # df['Explicit_Opt_in__c'] = 0
-            # df['Opt_in__c'] = 0
-            df['Marketing_Status__c'] = 'No Marketing'
-            df.shape
-
-            # Export
-            print('Exporting to CSV.')
-            os.makedirs('exports', exist_ok=True)
-            df.to_csv(r'exports/unsubscribe_contacts_' + datetime.datetime.today().strftime('%Y-%m-%d-%H-%M-%S') + '.csv', encoding='utf-8', index=False)
-
-            # Convert to list of dicts
-            target_data = df.to_dict('records')
-
+            # Explicit_Opt_in__c and Opt_in__c are left unchanged
+            # Skip contacts that are already unsubscribed
+            is_unsubscribed = np.asarray(columns['Unsubscribed'], dtype=bool)
+            print(f"Skipping {int(is_unsubscribed.sum())} contact(s) that are already unsubscribed.")
+            contact_ids = np.asarray(columns['Id'], dtype=object)[~is_unsubscribed].tolist()
+            target_data = export_csv(prefix + 'unsubscribe_contacts', iter_payloads(contact_ids, HasOptedOutOfEmail=1, Marketing_Status__c='No Marketing'))
+            journal.update('unsubscribe', contacts=target_data)
+
+        if len(target_data) > 0:
             # Push contact updates to SFDC
             print('Pushing the unsubscribe updates to contacts in SFDC. Please wait.')
-            result = sf.bulk.Contact.update(target_data,batch_size=500,use_serial=True)
-
-            # Print success count
-            success_list = [1 if d['success'] is True else 0 for d in result]
-            success_emoji = '✔️' if (len(success_list) - sum(success_list)) == 0 else '💥'
-            print("OK: " + str(sum(success_list)) + ", Fail: " + str(len(success_list) - sum(success_list)) + '. ' + success_emoji)
-
-            # Write results to file
-            print('Exporting the results.')
-            os.makedirs('results', exist_ok=True)
-            with open(r'results/results_unsubscribe_contacts_' + datetime.datetime.today().strftime('%Y-%m-%d-%H-%M-%S') + '.txt', 'w') as f:
-                for item in result:
-                    f.write("%s\n" % item)
-        else:
-            pass
+            push_bulk_stage(sf, journal, 'unsubscribe:contacts', 'Contact', 'update', target_data, prefix + 'unsubscribe_contacts', options)
 
     else:
         print('No unsubscribe requests to process.')
  
     # Process credit card removal requests
-    if len(cc_removal_email_list) > 0:
+    if len(cc_removal_email_list) > 0 and cc_removal_step.get('status') == 'done':
+        print('Credit card removal requests were already exported in the previous run.')
+
+    elif len(cc_removal_email_list) > 0:
     
-        # Filter credit card removal requests
-        df_cc = df_requests[df_requests.request_type == 'credit_card_removal'].reset_index(drop=True)
-        df_cc.shape
+        # Only the credit card export needs pandas
+        import pandas as pd
+
+        # Credit card removal requests
+        df_cc = pd.DataFrame(cc_rows)
         
         # Query credit card removal contacts
         print('Querying credit card removal contacts from SFDC.')
-        query = """
-        SELECT
-            Id,
-            Email,
-            AccountId,
-            Account.RecordTypeId
-        FROM Contact WHERE Email IN (
-            {0}
-        )
-        """
-
-        # Remove first and last line
-        query = "\n".join(query.split("\n")[1:-1])
-        # Add variables
-        query = query.format(cc_removal_email_list_str)
-        # Run query
-        data = sf.query_all(query)
-
-        # Get rows
-        rows = []
-        for item in data['records']:
-            row = {}
-            try:
-                row['Id'] = item['Id']
-                row['AccountId'] = item['AccountId']
-                row['Email'] = item['Email']
-            except:
-                pass
-            try:
-                row['RecordTypeId'] = item['Account']['RecordTypeId']
-            except:
-                pass
-            rows.append(row)
+        if options.combined_query:
+            # Already queried
+            records = records_by_type['credit_card_removal']
+        else:
+            # Run query in chunks, skipping cached contacts
+            records = lookup_contacts(sf, cc_removal_email_list, options)
 
         # To dataframe
-        df = pd.DataFrame(rows)
+        df = pd.DataFrame(extract_contact_columns(records), columns=['Id', 'AccountId', 'Email', 'RecordTypeId'])
         print(f"{df.shape[0]} contact(s) found.")
 
+        # Without matching contacts there is nothing to scan
+        scan_complete = True
         if df.shape[0] > 0:
 
             # Add URLs
             print('Generating SFDC links.')
-            df['sfdc_contact_link'] = 'https://rs.lightning.force.com/lightning/r/' + df['Id'] + '/view'
+            df['sfdc_contact_link'] = 'https://' + org['lightning_host'] + '/lightning/r/' + df['Id'] + '/view'
 
             # Change email addresses to lowercase
             df['Email'] = df['Email'].str.lower()
-            df_cc['Email'] = df_cc['Email'].str.lower()
+            df_cc['Email'] = df_cc['Email'].str.strip().str.lower()
 
             # Merge
             df_cc_final = df_cc.merge(df, on='Email', how='left')
@@ -410,23 +2091,51 @@ def handle_requests():
             # Export
             print('Exporting to CSV.')
             os.makedirs('exports', exist_ok=True)
-            df_cc_final.to_csv(r'exports/cc_removal_requests_with_contacts_' + datetime.datetime.today().strftime('%Y-%m-%d-%H-%M-%S') + '.csv', encoding='utf-8', index=False)
+            df_cc_final.to_csv(r'exports/' + prefix + 'cc_removal_requests_with_contacts_' + new_run_id() + '.csv', encoding='utf-8', index=False)
 
-            # Reminder
-            print("Don't forget to open the exported credit card removal requests file and manually look for credit card numbers in SFDC.")
+            # Look for card numbers in the text fields of the contacts and their cases and emails
+            if options.skip_card_scan:
+                print("Don't forget to open the exported credit card removal requests file and manually look for credit card numbers in SFDC.")
+                scan_complete = False
+            else:
+                print('Scanning contacts, cases, case comments and emails for credit card numbers. Please wait.')
+                hits, failed_sources = scan_for_card_numbers(sf, df['Id'].tolist(), options)
+                scan_complete = not failed_sources
+                if hits:
+                    df_hits = pd.DataFrame(hits)
+                    df_hits['sfdc_record_link'] = 'https://' + org['lightning_host'] + '/lightning/r/' + df_hits['record_id'] + '/view'
+                    hits_path = r'exports/' + prefix + 'cc_scan_hits_' + new_run_id() + '.csv'
+                    df_hits.to_csv(hits_path, encoding='utf-8', index=False)
+                    print(f"{len(hits)} possible credit card number(s) found in {df_hits['record_id'].nunique()} record(s). Review them in {hits_path}.")
+                else:
+                    print('No credit card numbers found.')
+                if failed_sources:
+                    print(f"The scan is incomplete, {', '.join(failed_sources)} records couldn't be read.")
+
+        journal.update('credit_card_removal:export', status='done', scanned=scan_complete)
 
     else:
         print('No credit card removal requests to process.')
 
-    input("Task completed. 🚀 Press Enter to return to the main menu...")
+    journal.finish()
+    if options.request_ledger is not None:
+        record_processed_requests(options.request_ledger, org['name'], routed_requests[org['name']], journal)
+    check_job_completed(journal, options)
 
-def handle_email_list():
+def handle_email_list(orgs, options, file_path=None):
     print("Handling list of email addresses...")
 
+    # Resume a previous job with the same input file and org
+    journal = resume_journal(options, 'emails')
+    if journal is not None:
+        file_path = journal.data['input']['file_path']
+        selected_orgs = select_orgs(orgs, options, [journal.data['input']['org']])
+    else:
+        selected_orgs = select_orgs(orgs, options)
+
     # Get lists of email addresses
-    root = tk.Tk()
-    root.withdraw()
-    file_path = filedialog.askopenfilename()
+    if file_path is None:
+        file_path = ask_for_file()
     
     # Handle case where no file is selected
     if not file_path:
@@ -434,254 +2143,368 @@ def handle_email_list():
         return  # Return to the main menu
     
     try:
-        with open(file_path) as f:
+        with run_report.stage('load_email_list') as details, open(file_path) as f:
             lines = f.readlines()
             contacts = [line.rstrip() for line in lines]
+            details['rows'] = len(contacts)
     except Exception as e:
+        if not options.interactive:
+            # Let scheduled runs fail with a non-zero exit code
+            raise ValueError(f"Error loading the file: {e}") from e
         print(f"Error loading the file: {e}. Returning to the main menu...")
         return  # Return to the main menu if file reading fails
     
-    # Split into chunks of length n
-    n = 400
-    contacts_chunks = [contacts[i:i + n] for i in range(0, len(contacts), n)]
-    total_chunks = len(contacts_chunks)
-    
     print(f"{len(contacts)} email addresses loaded.")
-    print(f'Splitting the data into {total_chunks} chunks of up to 400 contacts each.')
 
-    # Pause
-    input("Next step: Connect to SFDC. Press Enter to continue...")
+    # The list has no org column, so the orgs it applies to must be chosen
+    if journal is None and len(orgs) > 1 and not options.org_names:
+        message = f"Several orgs are configured ({', '.join(orgs)}). Pass --org to choose the org(s) the email list applies to."
+        if not options.interactive:
+            raise ValueError(message)
+        print(message + " Returning to the main menu...")
+        return
 
-    # Initiate SFDC connection
-    sf = Salesforce(
-        username=SFDC_USERNAME,
-        password=SFDC_PASSWORD,
-        security_token=SFDC_TOKEN
-    )
+    # Only query each valid address once
+    contacts, report = build_email_index(contacts)
+    print_email_report(report, 'bulk_list')
 
-    # Execute
-    for chunk_index, chunk in enumerate(contacts_chunks, start=1):
-        
-        # Escape apostrophes in email addresses
-        chunk = [email.replace("'", "\\'") for email in chunk]
+    # The list is applied to every selected org
+    run_for_orgs(selected_orgs, options, process_org_email_list, contacts, file_path, journal)
 
-        # To strings for query
-        print(f'Starting chunk {chunk_index} of {total_chunks}.')
-        contacts_str = ','.join(f"'{x}'" for x in chunk)
+    pause("Task completed. 🚀 Press Enter to return to the main menu...", options)
 
-        # Query data removal contacts
-        print('Querying contacts from SFDC.')
-        query = """
-        SELECT
-            Id,
-            AccountId,
-            Account.RecordTypeId
-        FROM Contact WHERE Email IN (
-            {0}
-        )
-        """
+def process_org_email_list(org, options, contacts, file_path, journal):
+    """ Flag the contacts of one org that match a list of email addresses """
+    prefix = file_prefix(options)
 
-        # Remove first and last line
-        query = "\n".join(query.split("\n")[1:-1])
-        # Add variables
-        query = query.format(contacts_str)
-        # Run query
-        data = sf.query_all(query)
+    # Query data removal contacts
+    if journal is not None:
+        # Reuse the chunks planned by the previous run so their checkpoints still match
+        queries = journal.data['queries']
+        has_cached_chunk = 'cached' in journal.data['steps']
+    else:
+        # Use cached contacts and split the rest into chunks that fit the query length limit
+        cached_records, queries = plan_contact_lookup(contacts, options)
+        journal = JobJournal.create('emails', {'file_path': file_path, 'org': org['name']})
+        journal.set(queries=queries)
+        has_cached_chunk = len(cached_records) > 0
+        if has_cached_chunk:
+            journal.update('cached', records=cached_records)
+
+    chunk_keys = (['cached'] if has_cached_chunk else []) + [f'chunk-{i}' for i in range(1, len(queries) + 1)]
+    total_chunks = len(chunk_keys)
+    print(f'Splitting the data into {total_chunks} chunks.')
 
-        if not data['records']:
-            print("No contacts found for this chunk.")
-        
-        else:
-            
-            # Get rows
-            rows = []
-            for item in data['records']:
-                row = {}
-                try:
-                    row['Id'] = item['Id']
-                    row['AccountId'] = item['AccountId']
-                except:
-                    pass
-                try:
-                    row['RecordTypeId'] = item['Account']['RecordTypeId']
-                except:
-                    pass
-                rows.append(row)
-
-            # To dataframe
-            df = pd.DataFrame(rows)
-            print(f"Identified {df.shape[0]} contact(s) to be flagged for deletion. (Setting `GDPR__c` to true.)")
-
-            # Check if data was found
-            if df.shape[0] > 0:
-                # Process contacts
-                df['GDPR__c'] = 1
-                df_contacts = df[[
-                    'Id',
-                    'GDPR__c'
-                ]]
-
-                # Export
-                print('Exporting to CSV.')
-                df_contacts.to_csv(r'exports/flag_contacts_from_bulk_list_' + datetime.datetime.today().strftime('%Y-%m-%d-%H-%M-%S') + '.csv', encoding='utf-8', index=False)
-                # Convert to lists of dicts
-                target_data_contacts = df_contacts.to_dict('records')
-        
-                try:
-                    # Push contact updates to SFDC
-                    print('Pushing the GDPR flag update to contacts in SFDC. Please wait.')
-                    result = sf.bulk.Contact.update(target_data_contacts,batch_size=500,use_serial=True)
-                    # Print success count
-                    success_list = [1 if d['success'] is True else 0 for d in result]
-                    success_emoji = '✔️' if (len(success_list) - sum(success_list)) == 0 else '💥'
-                    
-                    print("OK: " + str(sum(success_list)) + ", Fail: " + str(len(success_list) - sum(success_list)) + '. ' + success_emoji)
-                    # Write result to file
-                    
-                    print('Exporting the results.')
-                    os.makedirs('results', exist_ok=True)
-                    with open(r'results/results_flag_contacts_from_bulk_list_' + datetime.datetime.today().strftime('%Y-%m-%d-%H-%M-%S') + '.txt', 'w') as f:
-                        for item in result:
-                            f.write("%s\n" % item)
-                except:
-                    print('Contact update error.')
-
-                # Process accounts
-                df['GDPR_Account__c'] = np.where(df['RecordTypeId'] == '012d0000000W68QAAS', 1, 0)
-                print(f"Identified {df['GDPR_Account__c'].sum()} household account(s) to be flagged for deletion. (Setting `GDPR_Account__c` to true.)")
-
-                if df['GDPR_Account__c'].sum() > 0:
-
-                    # Drop columns
-                    df_accounts = df[[
-                        'AccountId',
-                        'GDPR_Account__c'
-                    ]]
-                    # Rename
-                    df_accounts = df_accounts.rename(columns={'AccountId': 'Id'}, inplace=False)
-                    # Filter
-                    df_accounts = df_accounts.loc[df_accounts['GDPR_Account__c'] == 1]
-                    # Export
-                    print('Exporting to CSV.')
-                    df_accounts.to_csv(r'exports/flag_accounts_' + datetime.datetime.today().strftime('%Y-%m-%d-%H-%M-%S') + '.csv', encoding='utf-8', index=False)
-                    # Convert to lists of dicts
-                    target_data_accounts = df_accounts.to_dict('records')
-        
-                    
-                    # Push account updates to SFDC
-                    print('Pushing the GDPR flag update to household accounts in SFDC. Please wait.')
-                    try:
-                        result = sf.bulk.Account.update(target_data_accounts,batch_size=500,use_serial=True)
-                        # Print success count
-                        success_list = [1 if d['success'] is True else 0 for d in result]
-                        success_emoji = '✔️' if (len(success_list) - sum(success_list)) == 0 else '💥'
-                        print("OK: " + str(sum(success_list)) + ", Fail: " + str(len(success_list) - sum(success_list)) + '. ' + success_emoji)
-                        # Write result to file
-                        print('Exporting the results.')
-                        with open(r'results/results_flag_accounts_from_bulk_list_' + datetime.datetime.today().strftime('%Y-%m-%d-%H-%M-%S') + '.txt', 'w') as f:
-                            for item in result:
-                                f.write("%s\n" % item)
-                    except:
-                        print('Account update error.')
-
-    input("Task completed. 🚀 Press Enter to return to the main menu...")
-
-def delete_flagged_records():
-    print("Deleting all flagged records...")
-    
     # Pause
-    input("Next step: Connect to SFDC. Press Enter to continue...")
+    pause("Next step: Connect to SFDC. Press Enter to continue...", options)
 
     # Initiate SFDC connection
-    sf = Salesforce(
-        username=SFDC_USERNAME,
-        password=SFDC_PASSWORD,
-        security_token=SFDC_TOKEN
-    )
+    sf = connect_to_sfdc(options)
 
-    # Query cases    
-    print('Querying all cases related to contacts flagged for deletion.')
-    query = """
-    SELECT
-        Id
-    FROM CASE WHERE Contact.GDPR__c = true
-    """
-
-    # Remove first and last line
-    query = "\n".join(query.split("\n")[1:-1])
-    # Run query
-    data = sf.query_all(query)
-
-    # To dataframe
-    df = pd.DataFrame(data['records']).drop(['attributes'],axis=1)
-    print(f"{df.shape[0]} case(s) found.")
+    if options.pipeline:
+        # Query the next chunks while the previous ones are being updated
+        print('Querying and updating contacts in SFDC. Please wait.')
+        import asyncio
+        asyncio.run(run_email_list_pipeline(sf, journal, chunk_keys, queries, options))
+    else:
+        # Only query the chunks that weren't checkpointed by a previous run
+        pending_queries = [query for i, query in enumerate(queries, start=1) if 'contacts' not in journal.step(f'chunk-{i}')]
+        # The bulk updates of each chunk run between the queries, so queries don't run ahead of them
+        query_results = run_contact_queries(sf, pending_queries, options, read_ahead=False)
 
-    # Export
-    print('Exporting to CSV.')
-    os.makedirs('exports', exist_ok=True)
-    df.to_csv(r'exports/gdpr_contact_cases_to_delete_' + datetime.datetime.today().strftime('%Y-%m-%d-%H-%M-%S') + '.csv', encoding='utf-8', index=False)
+        # Execute
+        print('Querying contacts from SFDC.')
+        for chunk_index, key in enumerate(chunk_keys, start=1):
+            
+            print(f'Starting chunk {chunk_index} of {total_chunks}.')
 
-    # Convert to lists of dicts
-    target_data_cases = df.to_dict('records')
+            step = journal.step(key)
+            if 'contacts' in step:
+                target_data_contacts = step['contacts']
+            else:
+                records = step['records'] if key == 'cached' else next(query_results)['records']
+                if not records:
+                    print("No contacts found for this chunk.")
+                target_data_contacts, target_data_accounts = build_gdpr_payloads(records, org['household_record_type_id'], prefix + 'flag_contacts_from_bulk_list')
+                journal.update(key, contacts=target_data_contacts, accounts=target_data_accounts)
 
-    # Push to SFDC
-    print('Deleting the cases in SFDC. Please wait.')
-    result = sf.bulk.Case.delete(target_data_cases,batch_size=500,use_serial=True)
+            if len(target_data_contacts) > 0:
+                try:
+                    # Push contact updates to SFDC
+                    print('Pushing the GDPR flag update to contacts in SFDC. Please wait.')
+                    push_bulk_stage(sf, journal, key + ':contacts', 'Contact', 'update', target_data_contacts, prefix + 'flag_contacts_from_bulk_list', options)
+                except Exception as e:
+                    # Keep going with the other chunks, this one is retried on resume
+                    journal.record_error(key + ':contacts', e)
+
+    # Flag each household account once, after all contact chunks
+    account_ids = dict.fromkeys(account['Id'] for key in chunk_keys for account in journal.step(key).get('accounts', []))
+    target_data_accounts = export_csv(prefix + 'flag_accounts', iter_payloads(account_ids, GDPR_Account__c=1))
+    print(f"{len(target_data_accounts)} unique household account(s) to flag across all chunks.")
+    if len(target_data_accounts) > 0:
+        # Push account updates to SFDC
+        print('Pushing the GDPR flag update to household accounts in SFDC. Please wait.')
+        try:
+            push_bulk_stage(sf, journal, 'accounts', 'Account', 'update', target_data_accounts, prefix + 'flag_accounts_from_bulk_list', options)
+        except Exception as e:
+            journal.record_error('accounts', e)
 
-    # Print success count
-    success_list = [1 if d['success'] is True else 0 for d in result]
-    success_emoji = '✔️' if (len(success_list) - sum(success_list)) == 0 else '💥'
-    print("OK: " + str(sum(success_list)) + ", Fail: " + str(len(success_list) - sum(success_list)) + '. ' + success_emoji)
+    journal.finish()
+    check_job_completed(journal, options)
 
-    # Write result to file
-    print('Exporting the results.')
-    os.makedirs('results', exist_ok=True)
-    with open(r'results/results_gdpr_contact_cases_to_delete_' + datetime.datetime.today().strftime('%Y-%m-%d-%H-%M-%S') + '.txt', 'w') as f:
-        for item in result:
-            f.write("%s\n" % item)
-
-    # Query contacts
-    print('Querying all contacts flagged for deletion.')
-    query = """
-    SELECT
-        Id
-    FROM Contact WHERE GDPR__c = true
-    """
-
-    # Remove first and last line
-    query = "\n".join(query.split("\n")[1:-1])
-    # Run query
-    data = sf.query_all(query)
-
-    # To dataframe
-    df = pd.DataFrame(data['records']).drop(['attributes'],axis=1)
-    print(f"{df.shape[0]} contact(s) found.")
-
-    # Export
-    print('Exporting to CSV.')
-    os.makedirs('exports', exist_ok=True)
-    df.to_csv(r'exports/gdpr_contacts_to_delete_' + datetime.datetime.today().strftime('%Y-%m-%d-%H-%M-%S') + '.csv', encoding='utf-8', index=False)
+def delete_flagged_records(orgs, options):
+    if options.dry_run:
+        print("Estimating the deletion of all flagged records, without deleting anything...")
+    else:
+        print("Deleting all flagged records...")
+    
+    # Pause
+    pause("Next step: Connect to SFDC. Press Enter to continue...", options)
 
-    # Convert to lists of dicts
-    target_data_contacts = df.to_dict('records')
+    run_for_orgs(select_orgs(orgs, options), options, delete_org_flagged_records)
 
-    # Push to SFDC
-    print('Deleting the contacts in SFDC. Please wait.')
-    result = sf.bulk.Contact.delete(target_data_contacts,batch_size=500,use_serial=True)
+    pause("Task completed. 🚀 Press Enter to return to the main menu...", options)
 
-    # Print success count
-    success_list = [1 if d['success'] is True else 0 for d in result]
-    success_emoji = '✔️' if (len(success_list) - sum(success_list)) == 0 else '💥'
-    print("OK: " + str(sum(success_list)) + ", Fail: " + str(len(success_list) - sum(success_list)) + '. ' + success_emoji)
+def delete_org_flagged_records(org, options):
+    # Initiate SFDC connection
+    sf = connect_to_sfdc(options)
+
+    if options.dry_run:
+        print_deletion_estimate(sf, options)
+        return
+
+    # Delete children before their parents, and the objects of each level at the same time
+    for level in build_deletion_plan(options):
+        print('Querying and deleting ' + ', '.join(label for object_name, query, name, label in level) + ' flagged for deletion. Please wait.')
+        with ThreadPoolExecutor(max_workers=len(level)) as executor:
+            futures = [submit_with_context(executor, delete_flagged_object, sf, object_name, query, name, label, options) for object_name, query, name, label in level]
+            for future in futures:
+                future.result()
+
+def print_deletion_estimate(sf, options):
+    """ Count the flagged records and estimate the deletion without deleting anything """
+    print(f"Dry run. Counting the records flagged for deletion, nothing is deleted. Operation: {deletion_operation(options)}, backend: {options.backend}.")
+    total = {'records': 0, 'batches': 0, 'api_calls': 0}
+    for level in build_deletion_plan(options, dry_run=True):
+        for object_name, query, name, label in level:
+            count = count_records(sf, query, options)
+            estimate = estimate_deletion(count, options)
+            print(f"{count} {label}: {estimate['batches']} batch(es) of up to {estimate['batch_size']} records, about {estimate['api_calls']} API call(s).")
+            total['records'] += count
+            total['batches'] += estimate['batches']
+            total['api_calls'] += estimate['api_calls']
+    print(f"Total: {total['records']} record(s), {total['batches']} batch(es), about {total['api_calls']} API call(s).")
 
-    # Write result to file
-    print('Exporting the results.')
-    os.makedirs('results', exist_ok=True)
-    with open(r'results/results_gdpr_contacts_to_delete_' + datetime.datetime.today().strftime('%Y-%m-%d-%H-%M-%S') + '.txt', 'w') as f:
-        for item in result:
-            f.write("%s\n" % item)
+    try:
+        daily = sf.limits()['DailyApiRequests']
+    except Exception:
+        return
+    print(f"{daily['Remaining']} of {daily['Max']} daily API requests remaining.")
+
+# Files picked up from the inbox by the watch command
+WATCH_REQUEST_EXTENSIONS = ('.csv', '.xlsx')
+WATCH_EMAIL_EXTENSIONS = ('.txt',)
+# Picked up only to be moved to the failed folder with an explanation
+WATCH_UNSUPPORTED_EXTENSIONS = ('.xls',)
+
+def list_inbox_files(inbox):
+    """ Map the exports and email lists in the inbox to their size and modification time """
+    files = {}
+    with os.scandir(inbox) as entries:
+        for entry in entries:
+            # Skip folders, hidden files and Office lock files
+            if not entry.is_file() or entry.name.startswith(('.', '~$')):
+                continue
+            if entry.name.lower().endswith(WATCH_REQUEST_EXTENSIONS + WATCH_EMAIL_EXTENSIONS + WATCH_UNSUPPORTED_EXTENSIONS):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    # Removed since the folder was listed
+                    continue
+                files[entry.path] = (stat.st_size, stat.st_mtime)
+    return files
+
+def merge_request_exports(file_paths, merged_path):
+    """ Combine OneTrust exports into one CSV with the columns of all of them """
+    fieldnames = {}
+    for file_path in file_paths:
+        # Only read the first row, closing the file right away
+        with contextlib.closing(iter_export_rows(file_path, guess_file_type(file_path))) as rows:
+            fieldnames.update(dict.fromkeys(next(rows, {})))
+    with open(merged_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=list(fieldnames), restval='', extrasaction='ignore')
+        writer.writeheader()
+        for file_path in file_paths:
+            writer.writerows(iter_export_rows(file_path, guess_file_type(file_path)))
+
+def merge_email_lists(file_paths, merged_path):
+    """ Combine TXT email lists into one """
+    with open(merged_path, 'w', encoding='utf-8') as merged_file:
+        for file_path in file_paths:
+            with open(file_path, encoding='utf-8-sig') as f:
+                for line in f:
+                    merged_file.write(line.rstrip('\r\n') + '\n')
+
+def keep_sessions_warm(orgs, options):
+    """ Log in to each org, or make a cheap API call to keep its session from expiring """
+    for org in select_orgs(orgs, options):
+        org_specific = org_options(options, org)
+        sf = connect_to_sfdc(org_specific)
+        call_with_retries(sf.limits, org_specific, 'Keepalive')
+
+def move_to_failed(options, batch_dir, file_paths):
+    """ Keep files that failed apart, so they can be checked and dropped into the inbox again """
+    failed_dir = os.path.join(options.failed, os.path.basename(batch_dir))
+    os.makedirs(failed_dir, exist_ok=True)
+    for file_path in file_paths:
+        try:
+            shutil.move(file_path, os.path.join(failed_dir, os.path.basename(file_path)))
+        except FileNotFoundError:
+            # Never written, like the merged file of a batch that failed early
+            continue
+        except OSError as e:
+            print(f"Could not move {file_path} to {failed_dir}: {e}")
+    return failed_dir
+
+def process_inbox_files(orgs, options, batch_dir, file_paths, action):
+    """ Process the exports or email lists of a batch together and return True on success """
+    if action == 'requests':
+        merged_path = os.path.join(batch_dir, 'merged_requests.csv')
+    else:
+        merged_path = os.path.join(batch_dir, 'merged_emails.txt')
 
-    input("Task completed. 🚀 Press Enter to return to the main menu...")
+    try:
+        # A file that can't be read fails its part of the batch, not the daemon
+        if action == 'requests':
+            merge_request_exports(file_paths, merged_path)
+            run_action(options, action, handle_requests, orgs, options, file_path=merged_path, file_type='csv')
+        else:
+            merge_email_lists(file_paths, merged_path)
+            run_action(options, action, handle_email_list, orgs, options, file_path=merged_path)
+    except Exception:
+        print("An error occurred:")
+        print(traceback.format_exc())
+        try:
+            failed_dir = move_to_failed(options, batch_dir, file_paths + [merged_path])
+        except OSError as e:
+            print(f"Could not create the failed folder: {e}. The files stay in {batch_dir}.")
+            return False
+        print(f"Moved the {action} files of the batch to {failed_dir}.")
+        return False
+    return True
+
+def process_inbox_batch(orgs, options, file_paths):
+    """ Move a batch of files from the inbox to the archive and process them, return True on success """
+    batch_id = new_run_id()
+    batch_dir = os.path.join(options.archive, batch_id)
+    try:
+        os.makedirs(batch_dir)
+    except OSError as e:
+        # The files stay in the inbox and are tried again in the next batch
+        print(f"Could not create the batch folder {batch_dir}: {e}")
+        return False
+
+    # Claim the files first so they are not picked up twice
+    ok = True
+    claimed = []
+    for file_path in file_paths:
+        target = os.path.join(batch_dir, os.path.basename(file_path))
+        try:
+            shutil.move(file_path, target)
+        except FileNotFoundError:
+            print(f"Skipping {file_path}, it was removed or renamed since it was found.")
+            continue
+        except OSError as e:
+            # Left in the inbox, so it is tried again in the next batch
+            print(f"Could not move {file_path} to {batch_dir}: {e}")
+            ok = False
+            continue
+        claimed.append(target)
+    if not claimed:
+        os.rmdir(batch_dir)
+        print(f"Batch {batch_id} has no files left.")
+        return ok
+    print(f"Processing batch {batch_id} with {len(claimed)} file(s).")
+
+    unsupported_files = [file_path for file_path in claimed if file_path.lower().endswith(WATCH_UNSUPPORTED_EXTENSIONS)]
+    if unsupported_files:
+        try:
+            failed_dir = move_to_failed(options, batch_dir, unsupported_files)
+            print(f"Legacy .xls files can't be read. Save them as XLSX or CSV and drop them into the inbox again. Moved {len(unsupported_files)} file(s) to {failed_dir}.")
+        except OSError as e:
+            print(f"Legacy .xls files can't be read. Could not create the failed folder: {e}. The files stay in {batch_dir}.")
+        ok = False
+
+    # All exports of the batch go through one run, and all email lists through another
+    request_files = [file_path for file_path in claimed if file_path.lower().endswith(WATCH_REQUEST_EXTENSIONS)]
+    email_files = [file_path for file_path in claimed if file_path.lower().endswith(WATCH_EMAIL_EXTENSIONS)]
+    if request_files:
+        ok = process_inbox_files(orgs, options, batch_dir, request_files, 'requests') and ok
+    if email_files:
+        ok = process_inbox_files(orgs, options, batch_dir, email_files, 'emails') and ok
+    if not os.listdir(batch_dir):
+        # Everything was moved to the failed folder
+        os.rmdir(batch_dir)
+    print(f"Batch {batch_id} {'archived in ' + batch_dir if ok else 'failed'}.")
+    return ok
+
+def watch_inbox(orgs, options):
+    """ Process the files dropped into the inbox in micro-batches until stopped """
+    for path in (options.inbox, options.archive, options.failed):
+        os.makedirs(path, exist_ok=True)
+
+    # Finish the current batch before stopping
+    stop = threading.Event()
+    previous_handlers = {}
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        previous_handlers[signal_number] = signal.signal(signal_number, lambda *args: stop.set())
+
+    # Log in once up front, and keep the session warm between batches
+    keep_sessions_warm(orgs, options)
+    last_keepalive = time.monotonic()
+
+    print(f"Watching {options.inbox} for OneTrust exports and email lists. Press Ctrl+C to stop.")
+    failed_batches = 0
+    previous = {}
+    first_ready_at = None
+    first_poll = True
+    try:
+        while not stop.is_set():
+            # Only take files whose size and modification time didn't change since the last check, so they are fully written
+            current = list_inbox_files(options.inbox)
+            ready = sorted(path for path, signature in current.items() if previous.get(path) == signature)
+            previous = current
+
+            if ready and first_ready_at is None:
+                first_ready_at = time.monotonic()
+                if not options.once:
+                    print(f"{len(ready)} new file(s) in the inbox. Collecting more for {options.window:g}s.")
+            if ready and (options.once or time.monotonic() - first_ready_at >= options.window):
+                if not process_inbox_batch(orgs, options, ready):
+                    failed_batches += 1
+                first_ready_at = None
+                last_keepalive = time.monotonic()
+            elif options.once and not first_poll:
+                break
+            elif time.monotonic() - last_keepalive >= options.keepalive * 60:
+                try:
+                    keep_sessions_warm(orgs, options)
+                except Exception as e:
+                    # A dropped connection shouldn't stop the daemon
+                    print(f"Keepalive failed: {e}. Trying again in {options.keepalive} minute(s).")
+                last_keepalive = time.monotonic()
+
+            first_poll = False
+            stop.wait(options.poll_interval)
+    finally:
+        for signal_number, handler in previous_handlers.items():
+            signal.signal(signal_number, handler)
+
+    print('Stopped watching the inbox.')
+    if failed_batches:
+        raise RuntimeError(f"{failed_batches} batch(es) failed. Their files were moved to {options.failed}.")
 
 if __name__ == '__main__':
-    main()
+    # Scan workers of the packaged executable start through the executable itself
+    multiprocessing.freeze_support()
+    sys.exit(main())
@@ -0,0 +1,22 @@
+""" Shared fixtures of the removal tool tests """
+
+import importlib.util
+import os
+import sys
+
+import pytest
+
+def load_tool():
+    """ Load the tool module from its script, whose name is not importable """
+    script_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'process-sfdc-data-removal-requests.py')
+    spec = importlib.util.spec_from_file_location('removal_tool', script_path)
+    module = importlib.util.module_from_spec(spec)
+    # Registered so worker processes can unpickle the module's functions
+    sys.modules['removal_tool'] = module
+    spec.loader.exec_module(module)
+    return module
+
+@pytest.fixture(scope='session')
+def tool():
+    return load_tool()
+
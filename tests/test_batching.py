@@ -0,0 +1,73 @@
+""" Tests of the bulk batching, adaptive batch sizes and retries """
+
+import argparse
+
+import pytest
+
+LOCK_ERROR = {'success': False, 'errors': [{'statusCode': 'UNABLE_TO_LOCK_ROW', 'message': 'unable to obtain exclusive access to this record'}]}
+SUCCESS = {'success': True, 'errors': []}
+
+def test_iter_batches_with_a_fixed_size(tool):
+    assert list(tool.iter_batches(range(5), 2)) == [[0, 1], [2, 3], [4]]
+
+def test_iter_batches_with_a_callable_size(tool):
+    # The size is asked for once more to find out there are no records left
+    sizes = iter([2, 3, 10, 10])
+    batches = list(tool.iter_batches(range(8), lambda: next(sizes)))
+    assert batches == [[0, 1], [2, 3, 4], [5, 6, 7]]
+
+def test_adaptive_batch_size_grows_on_fast_successful_batches(tool):
+    controller = tool.AdaptiveBatchSize(2000, maximum=4000)
+    controller.record(2000, [SUCCESS] * 2000, 5)
+    assert controller() == 3000
+    controller.record(3000, [SUCCESS] * 3000, 5)
+    assert controller() == 4000
+    # Never above the maximum
+    controller.record(4000, [SUCCESS] * 4000, 5)
+    assert controller() == 4000
+
+def test_adaptive_batch_size_only_grows_on_full_batches(tool):
+    controller = tool.AdaptiveBatchSize(2000)
+    controller.record(500, [SUCCESS] * 500, 1)
+    assert controller() == 2000
+
+def test_adaptive_batch_size_shrinks_on_lock_errors_and_slow_batches(tool):
+    controller = tool.AdaptiveBatchSize(2000, minimum=400)
+    controller.record(2000, [LOCK_ERROR] * 100 + [SUCCESS] * 1900, 5)
+    assert controller() == 1000
+    controller.record(1000, [SUCCESS] * 1000, 200)
+    assert controller() == 500
+    # Never below the minimum
+    controller.record(500, [LOCK_ERROR] * 500, 5)
+    assert controller() == 400
+
+def test_adaptive_batch_size_ignores_rare_lock_errors(tool):
+    controller = tool.AdaptiveBatchSize(2000)
+    controller.record(2000, [LOCK_ERROR] * 10 + [SUCCESS] * 1990, 5)
+    assert controller() == 2000
+
+def test_adaptive_controllers_are_shared_per_object_and_operation(tool):
+    options = argparse.Namespace(adaptive_batch_size=True, batch_size=2000, batch_size_controllers={})
+    controller = tool.get_batch_size(options, 'Contact', 'update')
+    assert tool.get_batch_size(options, 'Contact', 'update') is controller
+    assert tool.get_batch_size(options, 'Account', 'update') is not controller
+    assert tool.get_batch_size(argparse.Namespace(adaptive_batch_size=False, batch_size=2000), 'Contact', 'update') == 2000
+
+@pytest.mark.parametrize('item, retryable', [
+    (LOCK_ERROR, True),
+    ({'success': False, 'errors': [{'statusCode': 'REQUIRED_FIELD_MISSING'}]}, False),
+    (SUCCESS, False)
+])
+def test_only_lock_and_timeout_errors_are_retried(tool, item, retryable):
+    assert tool.is_retryable_error(item) is retryable
+
+def test_call_with_retries_gives_up_after_max_retries(tool, monkeypatch):
+    monkeypatch.setattr(tool.time, 'sleep', lambda seconds: None)
+    calls = []
+    def fail():
+        calls.append(1)
+        raise ConnectionError('connection reset')
+    options = argparse.Namespace(max_retries=2, retry_delay=1, session_manager=None)
+    with pytest.raises(ConnectionError):
+        tool.call_with_retries(fail, options, 'Query')
+    assert len(calls) == 3
@@ -0,0 +1,55 @@
+""" Tests of the credit card number scan """
+
+import argparse
+
+import pytest
+
+@pytest.mark.parametrize('digits', ['4111111111111111', '5500005555555559', '378282246310005', '6011000990139424'])
+def test_luhn_valid_accepts_test_card_numbers(tool, digits):
+    assert tool.luhn_valid(digits)
+
+@pytest.mark.parametrize('digits', ['4111111111111112', '1234567890123', '5500005555555558'])
+def test_luhn_valid_rejects_other_numbers(tool, digits):
+    assert not tool.luhn_valid(digits)
+
+def test_scan_texts_finds_and_masks_card_numbers(tool):
+    hits = tool.scan_texts([
+        ('Case', '500A', '003A', 'Description', 'Card 4111 1111 1111 1111, expires 12/27'),
+        ('Case', '500B', '003B', 'Subject', 'Card 4111-1111-1111-1111'),
+        ('EmailMessage', '02sC', '003C', 'TextBody', 'Order 1234567890123 and phone 555-123-4567'),
+        ('Contact', '003D', '003D', 'Description', 'Typo 4111111111111112')
+    ])
+    assert hits == [
+        {'object': 'Case', 'record_id': '500A', 'contact_id': '003A', 'field': 'Description', 'masked_number': '411111******1111'},
+        {'object': 'Case', 'record_id': '500B', 'contact_id': '003B', 'field': 'Subject', 'masked_number': '411111******1111'}
+    ]
+
+def test_scan_texts_ignores_numbers_inside_longer_digit_runs(tool):
+    # 20 digits are not a card number, even if 16 of them pass the Luhn check
+    assert tool.scan_texts([('Case', '500A', '003A', 'Description', '0000' + '4111111111111111')]) == []
+
+class ScanSalesforce:
+    """ Answers the scan queries with one record per object, failing for the objects it can't read """
+
+    def __init__(self, unreadable=()):
+        self.unreadable = unreadable
+
+    def query(self, query):
+        object_name = query.split(' FROM ')[1].split()[0]
+        if object_name in self.unreadable:
+            raise PermissionError(f'No access to {object_name}')
+        record = {'Id': '003A' if object_name == 'Contact' else object_name + '1', 'ContactId': '003A', 'Parent': {'ContactId': '003A'}}
+        record.update(dict.fromkeys(['Description', 'Subject', 'CommentBody', 'TextBody'], 'Paid with 4111 1111 1111 1111'))
+        return {'records': [record], 'done': True}
+
+def scan_options(scan_workers):
+    return argparse.Namespace(scan_workers=scan_workers, max_retries=0, session_manager=None)
+
+@pytest.mark.parametrize('scan_workers', [1, 2])
+def test_scan_for_card_numbers_reports_unreadable_objects(tool, scan_workers):
+    hits, failed_sources = tool.scan_for_card_numbers(ScanSalesforce(unreadable=['CaseComment']), ['003A'], scan_options(scan_workers))
+    assert sorted((hit['object'], hit['field']) for hit in hits) == [
+        ('Case', 'Description'), ('Case', 'Subject'), ('Contact', 'Description'), ('EmailMessage', 'Subject'), ('EmailMessage', 'TextBody')
+    ]
+    assert all(hit['contact_id'] == '003A' for hit in hits)
+    assert failed_sources == ['CaseComment']
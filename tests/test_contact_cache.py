@@ -0,0 +1,110 @@
+""" Tests of the on-disk email to contact cache """
+
+import argparse
+import sqlite3
+
+import pytest
+
+def contact(email, contact_id, account_id='001A', record_type_id='012H', **flags):
+    return dict({'Id': contact_id, 'Email': email, 'AccountId': account_id, 'Account': {'RecordTypeId': record_type_id}}, **flags)
+
+@pytest.fixture
+def clock(tool, monkeypatch):
+    """ A clock that only moves when the test moves it """
+    now = [1000000.0]
+    monkeypatch.setattr(tool.time, 'time', lambda: now[0])
+    return now
+
+def test_get_returns_hits_and_misses(tool, tmp_path):
+    cache = tool.ContactCache(str(tmp_path / 'contacts.sqlite'))
+    cache.put([contact('User1@Example.com', '003A'), contact('user2@example.com', '003B', account_id=None)])
+    records, missing = cache.get(['user1@example.com', ' USER2@example.com', 'user3@example.com'])
+    assert sorted(records, key=lambda record: record['Id']) == [
+        {'Id': '003A', 'Email': 'user1@example.com', 'GDPR__c': False, 'HasOptedOutOfEmail': False, 'Marketing_Status__c': None, 'AccountId': '001A', 'Account': {'RecordTypeId': '012H', 'GDPR_Account__c': False}},
+        {'Id': '003B', 'Email': 'user2@example.com', 'GDPR__c': False, 'HasOptedOutOfEmail': False, 'Marketing_Status__c': None, 'AccountId': None, 'Account': None}
+    ]
+    assert missing == ['user3@example.com']
+
+def test_put_replaces_older_entries_for_the_same_email(tool, tmp_path):
+    cache = tool.ContactCache(str(tmp_path / 'contacts.sqlite'))
+    cache.put([contact('user1@example.com', '003A'), contact('user1@example.com', '003B')])
+    cache.put([contact('user1@example.com', '003C')])
+    records, _ = cache.get(['user1@example.com'])
+    assert [record['Id'] for record in records] == ['003C']
+
+def test_entries_expire_after_the_ttl(tool, tmp_path, clock):
+    path = str(tmp_path / 'contacts.sqlite')
+    cache = tool.ContactCache(path, ttl_hours=1)
+    cache.put([contact('user1@example.com', '003A')])
+    clock[0] += 3599
+    assert cache.get(['user1@example.com'])[1] == []
+    clock[0] += 2
+    assert cache.get(['user1@example.com']) == ([], ['user1@example.com'])
+    # Expired entries are dropped when the cache is opened again
+    cache = tool.ContactCache(path, ttl_hours=1)
+    assert cache.connection.execute("SELECT COUNT(*) FROM contacts").fetchone()[0] == 0
+
+def test_least_recently_used_emails_are_evicted(tool, tmp_path, clock):
+    cache = tool.ContactCache(str(tmp_path / 'contacts.sqlite'), max_entries=2)
+    cache.put([contact('user1@example.com', '003A')])
+    clock[0] += 1
+    cache.put([contact('user2@example.com', '003B')])
+    clock[0] += 1
+    # Reading user1 makes user2 the least recently used
+    cache.get(['user1@example.com'])
+    clock[0] += 1
+    cache.put([contact('user3@example.com', '003C')])
+    assert cache.get(['user1@example.com', 'user2@example.com', 'user3@example.com'])[1] == ['user2@example.com']
+
+def test_invalidate_contacts_removes_deleted_contacts(tool, tmp_path):
+    cache = tool.ContactCache(str(tmp_path / 'contacts.sqlite'))
+    cache.CHUNK_SIZE = 2
+    cache.put([contact(f'user{i}@example.com', f'003{i}') for i in range(5)])
+    cache.invalidate_contacts(f'003{i}' for i in range(4))
+    assert cache.get([f'user{i}@example.com' for i in range(5)])[1] == [f'user{i}@example.com' for i in range(4)]
+
+def test_flags_are_cached_with_the_contacts(tool, tmp_path):
+    cache = tool.ContactCache(str(tmp_path / 'contacts.sqlite'))
+    record = contact('user1@example.com', '003A', GDPR__c=True, HasOptedOutOfEmail=True, Marketing_Status__c='No Marketing')
+    record['Account']['GDPR_Account__c'] = True
+    cache.put([record])
+    assert cache.get(['user1@example.com'])[0] == [record]
+
+def test_pushed_flags_update_the_cached_contacts_and_accounts(tool, tmp_path):
+    cache = tool.ContactCache(str(tmp_path / 'contacts.sqlite'))
+    cache.put([contact('user1@example.com', '003A', account_id='001A'), contact('user2@example.com', '003B', account_id='001B')])
+    options = argparse.Namespace(contact_cache=cache)
+    success, failure = {'success': True, 'errors': []}, {'success': False, 'errors': [{'statusCode': 'UNABLE_TO_LOCK_ROW'}]}
+
+    tool.cache_pushed_flags(options, 'Contact', 'update', [{'Id': '003A', 'GDPR__c': 1}, {'Id': '003B', 'GDPR__c': 1}], [success, failure])
+    tool.cache_pushed_flags(options, 'Account', 'update', [{'Id': '001A', 'GDPR_Account__c': 1}], [success])
+    tool.cache_pushed_flags(options, 'Contact', 'update', [{'Id': '003B', 'HasOptedOutOfEmail': 1, 'Marketing_Status__c': 'No Marketing'}], [success])
+
+    records = {record['Id']: record for record in cache.get(['user1@example.com', 'user2@example.com'])[0]}
+    # Only the updates that succeeded are cached
+    assert records['003A']['GDPR__c'] is True and records['003A']['Account']['GDPR_Account__c'] is True
+    assert records['003B']['GDPR__c'] is False and records['003B']['Account']['GDPR_Account__c'] is False
+    assert records['003B']['HasOptedOutOfEmail'] is True and records['003B']['Marketing_Status__c'] == 'No Marketing'
+
+def test_cached_flagged_contacts_are_not_updated_again(tool, tmp_path, monkeypatch):
+    pytest.importorskip('numpy')
+    # The payloads are exported to exports/ in the working directory
+    monkeypatch.chdir(tmp_path)
+    cache = tool.ContactCache(str(tmp_path / 'contacts.sqlite'))
+    cache.put([contact('user1@example.com', '003A', account_id='001A'), contact('user2@example.com', '003B', account_id='001B')])
+    tool.cache_pushed_flags(argparse.Namespace(contact_cache=cache), 'Contact', 'update', [{'Id': '003A', 'GDPR__c': 1}], [{'success': True, 'errors': []}])
+    tool.cache_pushed_flags(argparse.Namespace(contact_cache=cache), 'Account', 'update', [{'Id': '001A', 'GDPR_Account__c': 1}], [{'success': True, 'errors': []}])
+
+    records, _ = cache.get(['user1@example.com', 'user2@example.com'])
+    contacts, accounts = tool.build_gdpr_payloads(records, '012H', 'flag_contacts')
+    assert contacts == [{'Id': '003B', 'GDPR__c': 1}]
+    assert accounts == [{'Id': '001B', 'GDPR_Account__c': 1}]
+
+def test_caches_without_flags_are_started_over(tool, tmp_path):
+    path = str(tmp_path / 'contacts.sqlite')
+    with sqlite3.connect(path) as connection:
+        connection.execute("CREATE TABLE contacts (email TEXT NOT NULL, contact_id TEXT NOT NULL, account_id TEXT, record_type_id TEXT, cached_at REAL NOT NULL, last_used REAL NOT NULL)")
+        connection.execute("INSERT INTO contacts VALUES ('user1@example.com', '003A', '001A', '012H', 1e12, 1e12)")
+    connection.close()
+    cache = tool.ContactCache(path)
+    assert cache.get(['user1@example.com']) == ([], ['user1@example.com'])
@@ -0,0 +1,53 @@
+""" Tests of the dependency-ordered deletion plan """
+
+import argparse
+
+def deletion_options(org_name='default', delete_child=()):
+    return argparse.Namespace(org={'name': org_name}, delete_child=list(delete_child))
+
+def plan_objects(plan):
+    return [[object_name for object_name, _, _, _ in level] for level in plan]
+
+def test_children_are_deleted_before_contacts_and_accounts(tool):
+    plan = tool.build_deletion_plan(deletion_options())
+    assert plan_objects(plan) == [['Case'], ['Contact'], ['Account']]
+    assert plan[0][0] == ('Case', "SELECT Id FROM Case WHERE Contact.GDPR__c = true", 'gdpr_contact_cases_to_delete', 'cases')
+    assert plan[1][0][1] == "SELECT Id FROM Contact WHERE GDPR__c = true"
+
+def test_configured_children_join_the_first_level(tool):
+    plan = tool.build_deletion_plan(deletion_options(delete_child=['Task.Who', 'Opportunity_Contact__c.Contact__r']))
+    assert plan_objects(plan)[0] == ['Case', 'Task', 'Opportunity_Contact__c']
+    assert plan[0][1] == ('Task', "SELECT Id FROM Task WHERE Who.GDPR__c = true", 'gdpr_contact_task_to_delete', 'Task records')
+    assert plan[0][2][1] == "SELECT Id FROM Opportunity_Contact__c WHERE Contact__r.GDPR__c = true"
+
+def test_accounts_are_deleted_only_without_remaining_contacts(tool):
+    _, query, _, _ = tool.build_deletion_plan(deletion_options())[2][0]
+    assert query == "SELECT Id FROM Account WHERE GDPR_Account__c = true AND Id NOT IN (SELECT AccountId FROM Contact WHERE AccountId != null)"
+
+def test_export_names_are_prefixed_with_the_org(tool):
+    plan = tool.build_deletion_plan(deletion_options(org_name='emea'))
+    assert [name for level in plan for _, _, name, _ in level] == ['emea_gdpr_contact_cases_to_delete', 'emea_gdpr_contacts_to_delete', 'emea_gdpr_accounts_to_delete']
+
+def test_dry_run_leaves_flagged_contacts_out_of_the_remaining_ones(tool):
+    # The flagged contacts are still there during a dry run, but would be deleted before their accounts
+    _, query, _, _ = tool.build_deletion_plan(deletion_options(), dry_run=True)[2][0]
+    assert query.endswith("Id NOT IN (SELECT AccountId FROM Contact WHERE AccountId != null AND GDPR__c = false)")
+
+def batch_options(**values):
+    return argparse.Namespace(**dict({'batch_size': 2000, 'concurrency': 4, 'hard_delete': True, 'serial': False, 'adaptive_batch_size': False}, **values))
+
+def test_hard_delete_batches_spread_the_records_over_the_batches_in_flight(tool):
+    assert tool.plan_deletion_batch_size(100, batch_options()) == 2000
+    assert tool.plan_deletion_batch_size(20000, batch_options()) == 5000
+    assert tool.plan_deletion_batch_size(1000000, batch_options()) == tool.MAX_BATCH_SIZE
+
+def test_other_deletions_keep_the_batch_size(tool):
+    for values in [{'hard_delete': False}, {'serial': True}, {'adaptive_batch_size': True}]:
+        assert tool.plan_deletion_batch_size(20000, batch_options(**values)) == 2000
+
+def test_delete_flagged_dry_run_says_nothing_is_deleted(tool, monkeypatch, capsys):
+    monkeypatch.setattr(tool, 'run_for_orgs', lambda orgs, options, worker: None)
+    tool.delete_flagged_records({}, argparse.Namespace(dry_run=True, interactive=False, org_names=None))
+    output = capsys.readouterr().out
+    assert 'without deleting anything' in output
+    assert 'Deleting' not in output
@@ -0,0 +1,15 @@
+""" Tests of the email address normalization and deduplication """
+
+def test_build_email_index_counts(tool):
+    emails, report = tool.build_email_index([
+        'User1@Example.com', ' user1@example.com ', 'user2@example.com', '', '   ', 'not-an-email', 'user2@example.com'
+    ])
+    assert emails == ['user1@example.com', 'user2@example.com']
+    assert report == {'total': 7, 'duplicates': 2, 'blank': 2, 'rejected': ['not-an-email'], 'unique': 2}
+
+def test_build_email_index_keeps_the_first_order(tool):
+    emails, _ = tool.build_email_index(['c@example.com', 'a@example.com', 'C@example.com', 'b@example.com'])
+    assert emails == ['c@example.com', 'a@example.com', 'b@example.com']
+
+def test_normalize_email(tool):
+    assert tool.normalize_email('  O\'Neil@Example.COM\n') == "o'neil@example.com"
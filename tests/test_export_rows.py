@@ -0,0 +1,62 @@
+""" Tests of reading OneTrust exports row by row """
+
+import csv
+
+import pytest
+
+HEADER = ['Request ID', 'Task Assignee - Subtask', 'Workflows', 'Brand', 'Notes', 'Email']
+ROWS = [
+    ['R1', 'Salesforce', '[Consumer] Data Removal', 'IXL', 'long note', 'user1@example.com'],
+    ['R2', 'Marketo', '[Consumer] Data Removal', 'IXL', '', 'user2@example.com'],
+    ['R3', 'Salesforce', '[Consumer] Credit Card Removal', 'IXL', 'card on file', 'user3@example.com'],
+    ['R4', 'Salesforce', '[Consumer] Access Request', 'IXL', '', 'user4@example.com'],
+    ['R5', 'Salesforce', '[Consumer] Unsubscribe', 'IXL', '', ''],
+    # A short row, without its last columns
+    ['R6', 'Salesforce', '[Consumer] Unsubscribe']
+]
+
+def write_csv(path, header, rows):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+    return str(path)
+
+def write_xlsx(path, header, rows):
+    openpyxl = pytest.importorskip('openpyxl')
+    workbook = openpyxl.Workbook()
+    workbook.active.append(header)
+    for row in rows:
+        workbook.active.append([None if value == '' else value for value in row])
+    workbook.save(path)
+    return str(path)
+
+@pytest.fixture(params=['csv', 'xlsx'])
+def export(request, tmp_path):
+    if request.param == 'csv':
+        return write_csv(tmp_path / 'export.csv', HEADER, ROWS), 'csv'
+    return write_xlsx(tmp_path / 'export.xlsx', HEADER, ROWS), 'xlsx'
+
+def test_requests_only_keep_the_needed_columns(tool, export):
+    counts = {'loaded': 0, 'salesforce': 0}
+    requests = list(tool.iter_requests(*export, counts, extra_columns=['Request ID', 'Missing']))
+    assert requests == [
+        ('data_removal', {'Task Assignee - Subtask': 'Salesforce', 'Workflows': '[Consumer] Data Removal', 'Email': 'user1@example.com', 'Request ID': 'R1'}),
+        # Credit card removals keep the full row for their export
+        ('credit_card_removal', dict(zip(HEADER, ROWS[2])))
+    ]
+    assert counts == {'loaded': 6, 'salesforce': 5}
+
+def test_requests_need_the_request_columns(tool, tmp_path):
+    file_path = write_csv(tmp_path / 'export.csv', ['Task Assignee - Subtask', 'Email'], [])
+    with pytest.raises(ValueError, match='Missing column\\(s\\): Workflows'):
+        list(tool.iter_requests(file_path, 'csv', {'loaded': 0, 'salesforce': 0}))
+
+def test_export_rows_are_full_dicts_of_strings(tool, export):
+    rows = list(tool.iter_export_rows(*export))
+    assert rows[0] == dict(zip(HEADER, ROWS[0]))
+    assert rows[5] == {'Request ID': 'R6', 'Task Assignee - Subtask': 'Salesforce', 'Workflows': '[Consumer] Unsubscribe', 'Brand': '', 'Notes': '', 'Email': ''}
+
+def test_legacy_xls_files_are_rejected(tool, tmp_path):
+    with pytest.raises(ValueError, match='XLSX or CSV'):
+        list(tool.iter_export_rows(str(tmp_path / 'export.xls'), 'xlsx'))
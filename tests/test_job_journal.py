@@ -0,0 +1,64 @@
+""" Tests of the job journal replay used by --resume """
+
+import json
+
+import pytest
+
+@pytest.fixture(autouse=True)
+def jobs_dir(tmp_path, monkeypatch):
+    # Journals are written to jobs/ in the working directory
+    monkeypatch.chdir(tmp_path)
+    return tmp_path / 'jobs'
+
+def test_load_replays_steps_and_job_values(tool):
+    journal = tool.JobJournal.create('emails', {'file_path': 'emails.txt'})
+    journal.set(queries=['query 1', 'query 2'])
+    journal.update('chunk-1', contacts=[{'Id': '003A'}])
+    journal.update('chunk-1', status='done')
+    journal.record_error('chunk-2:contacts', RuntimeError('bulk down'))
+
+    loaded = tool.JobJournal.load(journal.data['job_id'])
+    assert loaded.data == journal.data
+    assert loaded.step('chunk-1') == {'contacts': [{'Id': '003A'}], 'status': 'done'}
+    assert loaded.step('chunk-2:contacts') == {'status': 'error', 'error': 'RuntimeError: bulk down'}
+    assert loaded.step('chunk-3') == {}
+
+def test_finish_marks_jobs_with_failed_stages_incomplete(tool):
+    journal = tool.JobJournal.create('emails', {})
+    journal.record_error('accounts', RuntimeError('bulk down'))
+    journal.finish()
+    assert tool.JobJournal.load(journal.data['job_id']).data['status'] == 'incomplete'
+    journal.update('accounts', status='done')
+    journal.finish()
+    assert tool.JobJournal.load(journal.data['job_id']).data['status'] == 'completed'
+
+def test_resume_after_a_half_written_line(tool, jobs_dir):
+    journal = tool.JobJournal.create('emails', {})
+    journal.update('chunk-1', status='done')
+    job_id = journal.data['job_id']
+    # The process died while writing the next checkpoint
+    with open(jobs_dir / (job_id + '.jsonl'), 'a', encoding='utf-8') as f:
+        f.write('{"step": "chunk-2", "val')
+
+    resumed = tool.JobJournal.load(job_id)
+    assert resumed.step('chunk-1') == {'status': 'done'}
+    assert resumed.step('chunk-2') == {}
+    # Checkpoints of the resumed run are kept, and the job can be resumed again
+    resumed.update('chunk-2', status='done')
+    resumed.update('chunk-3', status='done')
+    loaded = tool.JobJournal.load(job_id)
+    assert loaded.step('chunk-2') == {'status': 'done'}
+    assert loaded.step('chunk-3') == {'status': 'done'}
+    with open(jobs_dir / (job_id + '.jsonl'), encoding='utf-8') as f:
+        assert all(json.loads(line) for line in f)
+
+def test_load_rejects_corrupt_lines_before_the_last(tool, jobs_dir):
+    journal = tool.JobJournal.create('emails', {})
+    with open(jobs_dir / (journal.data['job_id'] + '.jsonl'), 'a', encoding='utf-8') as f:
+        f.write('not json\n{"status": "completed"}\n')
+    with pytest.raises(json.JSONDecodeError):
+        tool.JobJournal.load(journal.data['job_id'])
+
+def test_load_unknown_job(tool):
+    with pytest.raises(FileNotFoundError):
+        tool.JobJournal.load('missing')
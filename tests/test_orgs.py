@@ -0,0 +1,55 @@
+""" Tests of routing requests to orgs and running the orgs in parallel """
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+ORGS = {
+    'default': {'name': 'default', 'routes': ['IXL']},
+    'rosetta': {'name': 'rosetta', 'routes': ['Rosetta Stone', 'RS']}
+}
+
+def test_route_request_by_the_routing_column(tool):
+    assert tool.route_request({'Brand': 'IXL'}, ORGS, 'Brand') == 'default'
+    assert tool.route_request({'Brand': ' RS '}, ORGS, 'Brand') == 'rosetta'
+
+def test_unmatched_requests_are_not_routed(tool):
+    assert tool.route_request({'Brand': 'Other'}, ORGS, 'Brand') is None
+    assert tool.route_request({'Brand': ''}, ORGS, 'Brand') is None
+
+def test_a_single_org_gets_every_request(tool):
+    assert tool.route_request({}, {'default': ORGS['default']}, None) == 'default'
+
+def test_several_orgs_need_the_routing_column(tool):
+    with pytest.raises(ValueError, match='COLUMN'):
+        tool.route_request({'Brand': 'IXL'}, ORGS, None)
+    with pytest.raises(ValueError, match='Missing routing column: Brand'):
+        tool.route_request({'Email': 'user1@example.com'}, ORGS, 'Brand')
+
+def org(name):
+    return {'name': name, 'session_manager': None, 'contact_cache': None, 'max_concurrency': None}
+
+def test_parallel_orgs_prefix_every_line_of_their_output(tool, capsys):
+    def worker(org, options):
+        print(f"Started job of {org['name']}.\nTwo lines at once.")
+        # Threads started by the worker, like bulk batches, print with its prefix too
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            for future in [tool.submit_with_context(executor, print, 'Retrying batch', i) for i in range(2)]:
+                future.result()
+        if org['name'] == 'rosetta':
+            raise RuntimeError('login failed')
+
+    options = argparse.Namespace(interactive=False, concurrency=4)
+    with pytest.raises(RuntimeError, match='rosetta'):
+        tool.run_for_orgs([org('default'), org('rosetta')], options, worker)
+
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0] == 'Processing 2 orgs in parallel: default, rosetta.'
+    for name in ['default', 'rosetta']:
+        prefix = f'[{name}] '
+        org_lines = [line[len(prefix):] for line in lines if line.startswith(prefix)]
+        assert org_lines[:2] == [f'Started job of {name}.', 'Two lines at once.']
+        assert sorted(org_lines[2:4]) == ['Retrying batch 0', 'Retrying batch 1']
+    assert all(line.startswith(('[default] ', '[rosetta] ')) for line in lines[1:])
+    assert '[rosetta] RuntimeError: login failed' in lines
@@ -0,0 +1,79 @@
+""" Tests of SOQL quoting and the chunked IN-clause query planning """
+
+import argparse
+import threading
+import time
+from urllib.parse import quote_plus
+
+import pytest
+
+def test_soql_quote_escapes_apostrophes_and_backslashes(tool):
+    assert tool.soql_quote("o'neil@example.com") == "'o\\'neil@example.com'"
+    assert tool.soql_quote('back\\slash@example.com') == "'back\\\\slash@example.com'"
+    # Backslashes are escaped before apostrophes, so an escaped apostrophe can't be unescaped
+    assert tool.soql_quote("\\'") == "'\\\\\\''"
+
+def test_plan_in_clause_queries_keeps_every_value_once(tool):
+    emails = [f'user{i}@example.com' for i in range(2000)]
+    queries = tool.plan_in_clause_queries(tool.CONTACT_QUERY, emails)
+    assert len(queries) > 1
+    quoted = [value for query in queries for value in query[query.index('IN (') + 4:-1].split(',')]
+    assert quoted == [tool.soql_quote(email) for email in emails]
+
+def test_plan_in_clause_queries_stays_under_the_url_limit(tool):
+    # Non-ASCII and escaped characters are longer once URL-encoded
+    emails = [f"jürgen.o'neil{i}@example.com" for i in range(500)]
+    queries = tool.plan_in_clause_queries(tool.CONTACT_QUERY, emails, max_length=2000)
+    assert all(len(quote_plus(query)) <= 2000 for query in queries)
+    # Each query is packed, adding the next value would cross the limit
+    for query, next_query in zip(queries, queries[1:]):
+        next_value = next_query[next_query.index('IN (') + 4:-1].split(',')[0]
+        assert len(quote_plus(query[:-1] + ',' + next_value + ')')) > 2000
+
+def test_plan_in_clause_queries_without_values(tool):
+    assert tool.plan_in_clause_queries(tool.CONTACT_QUERY, []) == []
+
+class CountingSalesforce:
+    """ Answers each query with its own text, tracking the most queries running at once """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = 0
+        self.max_running = 0
+        self.calls = 0
+
+    def query_all(self, query):
+        with self.lock:
+            self.running += 1
+            self.calls += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(0.01)
+        with self.lock:
+            self.running -= 1
+        return {'records': [{'query': query}]}
+
+def query_options(concurrency):
+    return argparse.Namespace(concurrency=concurrency, max_retries=0, session_manager=None)
+
+@pytest.mark.parametrize('read_ahead', [True, False])
+def test_run_queries_yields_in_order_within_concurrency(tool, read_ahead):
+    sf = CountingSalesforce()
+    queries = [f'query {i}' for i in range(10)]
+    results = tool.run_queries(sf, queries, query_options(3), read_ahead)
+    assert [data['records'][0]['query'] for data in results] == queries
+    assert sf.max_running == 3
+
+def test_run_queries_without_read_ahead_runs_nothing_while_the_caller_works(tool):
+    sf = CountingSalesforce()
+    for data in tool.run_queries(sf, [f'query {i}' for i in range(10)], query_options(3), read_ahead=False):
+        # The caller's own API calls, like the bulk updates of a chunk, run here
+        time.sleep(0.02)
+        assert sf.running == 0
+
+def test_run_queries_submits_queries_as_results_are_taken(tool):
+    sf = CountingSalesforce()
+    results = tool.run_queries(sf, (f'query {i}' for i in range(100)), query_options(2))
+    next(results)
+    results.close()
+    # Only the queries of the first window ran, not all 100
+    assert sf.calls == 2
@@ -0,0 +1,69 @@
+""" Tests of the ledger of OneTrust requests processed by earlier runs """
+
+import argparse
+
+import pytest
+
+@pytest.fixture
+def ledger(tool, tmp_path):
+    return tool.RequestLedger(str(tmp_path / 'cache' / 'requests.sqlite'))
+
+def test_only_done_requests_are_processed(ledger):
+    ledger.record('default', 'data_removal', ['R1', 'R2'], 'done')
+    ledger.record('default', 'data_removal', ['R3'], 'failed')
+    assert ledger.processed('default', 'data_removal', ['R1', 'R2', 'R3', 'R4']) == {'R1', 'R2'}
+
+def test_requests_are_kept_per_org_and_request_type(ledger):
+    ledger.record('default', 'data_removal', ['R1'], 'done')
+    assert ledger.processed('rosetta', 'data_removal', ['R1']) == set()
+    assert ledger.processed('default', 'unsubscribe', ['R1']) == set()
+
+def test_a_later_status_replaces_the_earlier_one(ledger):
+    ledger.record('default', 'unsubscribe', ['R1', 'R2'], 'failed')
+    ledger.record('default', 'unsubscribe', ['R1'], 'done')
+    assert ledger.processed('default', 'unsubscribe', ['R1', 'R2']) == {'R1'}
+    ledger.record('default', 'unsubscribe', ['R1'], 'failed')
+    assert ledger.processed('default', 'unsubscribe', ['R1', 'R2']) == set()
+
+def test_lookups_are_chunked(ledger):
+    ledger.CHUNK_SIZE = 3
+    ledger.record('default', 'data_removal', [f'R{i}' for i in range(10)], 'done')
+    assert ledger.processed('default', 'data_removal', [f'R{i}' for i in range(0, 20, 2)]) == {'R0', 'R2', 'R4', 'R6', 'R8'}
+
+def test_request_key_falls_back_to_the_email(tool):
+    options = argparse.Namespace(request_id_column='Request ID')
+    assert tool.request_key({'Request ID': ' R1 ', 'Email': 'user1@example.com'}, options) == 'R1'
+    assert tool.request_key({'Request ID': '', 'Email': ' User1@Example.com'}, options) == 'user1@example.com'
+    assert tool.request_key({'Email': 'user1@example.com'}, options) == 'user1@example.com'
+
+def test_skip_processed_requests_keeps_the_lists_aligned(tool, ledger):
+    ledger.record('default', 'data_removal', ['R1'], 'done')
+    ledger.record('default', 'credit_card_removal', ['R4'], 'done')
+    routed_requests = {'default': {
+        'keys': {'data_removal': ['R1', 'R2'], 'unsubscribe': ['R3'], 'credit_card_removal': ['R4', 'R5']},
+        'email_lists': {'data_removal': ['user1@example.com', 'user2@example.com'], 'unsubscribe': ['user3@example.com'], 'credit_card_removal': ['user4@example.com', 'user5@example.com']},
+        'cc_rows': [{'Email': 'user4@example.com'}, {'Email': 'user5@example.com'}]
+    }}
+    assert tool.skip_processed_requests(ledger, routed_requests) == 2
+    assert routed_requests['default'] == {
+        'keys': {'data_removal': ['R2'], 'unsubscribe': ['R3'], 'credit_card_removal': ['R5']},
+        'email_lists': {'data_removal': ['user2@example.com'], 'unsubscribe': ['user3@example.com'], 'credit_card_removal': ['user5@example.com']},
+        'cc_rows': [{'Email': 'user5@example.com'}]
+    }
+
+def test_requests_are_done_only_when_their_stages_succeeded(tool, ledger, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    journal = tool.JobJournal.create('requests', {})
+    journal.update('data_removal:contacts', status='done', failed_count=0)
+    journal.update('unsubscribe:contacts', status='done', failed_count=1)
+    # Some objects couldn't be scanned
+    journal.update('credit_card_removal:export', scanned=False)
+    routed = {'keys': {'data_removal': ['R1'], 'unsubscribe': ['R2'], 'credit_card_removal': ['R3']}}
+    tool.record_processed_requests(ledger, 'default', routed, journal)
+    assert ledger.processed('default', 'data_removal', ['R1']) == {'R1'}
+    assert ledger.processed('default', 'unsubscribe', ['R2']) == set()
+    assert ledger.processed('default', 'credit_card_removal', ['R3']) == set()
+
+    journal.update('credit_card_removal:export', scanned=True)
+    tool.record_processed_requests(ledger, 'default', routed, journal)
+    assert ledger.processed('default', 'credit_card_removal', ['R3']) == {'R3'}
@@ -0,0 +1,63 @@
+""" Tests of claiming the files of an inbox batch """
+
+import argparse
+import os
+
+import pytest
+
+@pytest.fixture
+def folders(tmp_path):
+    options = argparse.Namespace(inbox=str(tmp_path / 'inbox'), archive=str(tmp_path / 'archive'), failed=str(tmp_path / 'failed'))
+    for path in (options.inbox, options.archive, options.failed):
+        os.makedirs(path)
+    return options
+
+def drop(options, name, text='user1@example.com\n'):
+    path = os.path.join(options.inbox, name)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    return path
+
+@pytest.fixture
+def processed(tool, monkeypatch):
+    """ Record the files handed to each action instead of running it """
+    calls = []
+    def process_inbox_files(orgs, options, batch_dir, file_paths, action):
+        calls.append((action, sorted(os.path.basename(file_path) for file_path in file_paths)))
+        return True
+    monkeypatch.setattr(tool, 'process_inbox_files', process_inbox_files)
+    return calls
+
+def test_files_removed_before_the_batch_are_skipped(tool, folders, processed):
+    kept = drop(folders, 'kept.txt')
+    gone = drop(folders, 'gone.txt')
+    os.remove(gone)
+    assert tool.process_inbox_batch({}, folders, [kept, gone]) is True
+    assert processed == [('emails', ['kept.txt'])]
+    assert os.listdir(folders.inbox) == []
+
+def test_a_batch_whose_files_are_all_gone_is_dropped(tool, folders, processed):
+    gone = drop(folders, 'gone.csv')
+    os.remove(gone)
+    assert tool.process_inbox_batch({}, folders, [gone]) is True
+    assert processed == []
+    assert os.listdir(folders.archive) == []
+
+def test_files_that_cant_be_claimed_stay_in_the_inbox(tool, folders, processed, monkeypatch):
+    kept = drop(folders, 'kept.txt')
+    locked = drop(folders, 'locked.txt')
+    move = tool.shutil.move
+    def move_unless_locked(source, target):
+        if source == locked:
+            raise PermissionError('The file is open in another program')
+        return move(source, target)
+    monkeypatch.setattr(tool.shutil, 'move', move_unless_locked)
+    assert tool.process_inbox_batch({}, folders, [kept, locked]) is False
+    assert processed == [('emails', ['kept.txt'])]
+    assert os.listdir(folders.inbox) == ['locked.txt']
+
+def test_list_inbox_files_only_lists_supported_files(tool, folders):
+    for name in ['export.csv', 'export.xlsx', 'emails.txt', 'old.xls', 'notes.pdf', '.hidden.csv', '~$export.xlsx']:
+        drop(folders, name)
+    os.makedirs(os.path.join(folders.inbox, 'folder.csv'))
+    assert sorted(os.path.basename(path) for path in tool.list_inbox_files(folders.inbox)) == ['emails.txt', 'export.csv', 'export.xlsx', 'old.xls']